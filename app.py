@@ -1,11 +1,39 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from models.database import get_session, User, Equipment, Usage, Prediction
+from flask import Flask, Response, jsonify, render_template, request, redirect, url_for, session, flash, stream_with_context
+from models.database import get_db, close_db, dispose_engine, get_current_user, invalidate_user, User, Equipment, Usage, Prediction
+from utils.rollup import record_usage_added, record_usage_removed, record_equipment_removed
+from utils.cache import bump_data_version, analytics_etag
+from utils.alerts import enqueue_alert_check
+from utils.metrics import init_app as init_metrics
+from utils.profiler import install as install_profiler
 from datetime import datetime, timedelta
 from functools import wraps
+import io
+import config
 
 app = Flask(__name__)
 app.secret_key = 'votre_cle_secrete_super_securisee_123'
 
+# Une session SQLAlchemy par requête, fermée automatiquement à la fin
+app.teardown_appcontext(close_db)
+
+# Durée, requêtes SQL et lignes lues par requête (exposées par /admin/metrics)
+init_metrics(app)
+
+# Instructions SQL lentes et leur plan d'exécution (ECOSENSE_QUERY_PROFILER=1, panel d'administration)
+install_profiler()
+
+
+def usage_delta(usage, sign):
+    """Effet d'une utilisation ajoutée (sign=1) ou retirée (sign=-1) sur les séries journalières"""
+    return usage.equipment_id, usage.date.date(), sign * usage.consommation_kwh, sign
+
+
+def update_series(user_id, version, deltas):
+    """Après le commit : corrige les séries en mémoire (config.ANALYTICS_BACKEND = 'series')"""
+    if config.ANALYTICS_BACKEND == 'series':
+        from utils.series import patch_series
+        patch_series(user_id, version, deltas)
+
 
 def login_required(f):
     @wraps(f)
@@ -43,27 +71,24 @@ def register():
             flash('Les mots de passe ne correspondent pas.', 'danger')
             return redirect(url_for('register'))
 
-        db = get_session()
-        try:
-            existing_user = db.query(User).filter(
-                (User.username == username) | (User.email == email)
-            ).first()
+        db = get_db()
+        existing_user = db.query(User).filter(
+            (User.username == username) | (User.email == email)
+        ).first()
 
-            if existing_user:
-                flash('Nom d\'utilisateur ou email déjà utilisé.', 'danger')
-                return redirect(url_for('register'))
+        if existing_user:
+            flash('Nom d\'utilisateur ou email déjà utilisé.', 'danger')
+            return redirect(url_for('register'))
 
-            new_user = User(username=username, email=email)
-            new_user.set_password(password)
-            new_user.is_admin = 0  # Utilisateur normal
-            new_user.is_approved = 0  # En attente de validation
-            db.add(new_user)
-            db.commit()
+        new_user = User(username=username, email=email)
+        new_user.set_password(password)
+        new_user.is_admin = 0  # Utilisateur normal
+        new_user.is_approved = 0  # En attente de validation
+        db.add(new_user)
+        db.commit()
 
-            flash('Inscription réussie ! En attente de validation par l\'administrateur.', 'info')
-            return redirect(url_for('login'))
-        finally:
-            db.close()
+        flash('Inscription réussie ! En attente de validation par l\'administrateur.', 'info')
+        return redirect(url_for('login'))
 
     return render_template('register.html')
 
@@ -75,25 +100,22 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
 
-        db = get_session()
-        try:
-            user = db.query(User).filter(User.username == username).first()
-
-            if user and user.check_password(password):
-                # Vérifier si le compte est approuvé
-                if user.is_approved == 0:
-                    flash('Votre compte est en attente de validation par l\'administrateur.', 'warning')
-                    return redirect(url_for('login'))
-
-                session['user_id'] = user.id
-                session['username'] = user.username
-                session['is_admin'] = user.is_admin
-                flash(f'Bienvenue {user.username} !', 'success')
-                return redirect(url_for('home'))
-            else:
-                flash('Identifiants incorrects.', 'danger')
-        finally:
-            db.close()
+        db = get_db()
+        user = db.query(User).filter(User.username == username).first()
+
+        if user and user.check_password(password):
+            # Vérifier si le compte est approuvé
+            if user.is_approved == 0:
+                flash('Votre compte est en attente de validation par l\'administrateur.', 'warning')
+                return redirect(url_for('login'))
+
+            session['user_id'] = user.id
+            session['username'] = user.username
+            session['is_admin'] = user.is_admin
+            flash(f'Bienvenue {user.username} !', 'success')
+            return redirect(url_for('home'))
+        else:
+            flash('Identifiants incorrects.', 'danger')
 
     return render_template('login.html')
 
@@ -110,64 +132,53 @@ def logout():
 @login_required
 def home():
     user_id = session['user_id']
-    db = get_session()
-
-    try:
-        from utils.calculations import get_user_alerts
+    db = get_db()
 
-        # Récupérer l'utilisateur
-        user = db.query(User).filter(User.id == user_id).first()
+    from utils.calculations import aggregations, get_user_alerts
 
-        today = datetime.now().date()
-        today_start = datetime.combine(today, datetime.min.time())
-        today_end = datetime.combine(today, datetime.max.time())
+    # Utilisateur courant (lu une seule fois par requête)
+    user = get_current_user()
 
-        usages_today = db.query(Usage).filter(
-            Usage.user_id == user_id,
-            Usage.date >= today_start,
-            Usage.date <= today_end
-        ).all()
+    today = datetime.now().date()
+    today_start = datetime.combine(today, datetime.min.time())
 
-        total_today = sum(usage.consommation_kwh for usage in usages_today)
+    total_today = aggregations().total_consumption(db, user_id, today_start, today_start + timedelta(days=1))
 
-        recent_usages = db.query(Usage).filter(
-            Usage.user_id == user_id
-        ).order_by(Usage.date.desc()).limit(5).all()
+    # 5 dernières utilisations, nom de l'équipement compris (une seule requête)
+    from utils.history import history_page
+    recent_usages, _ = history_page(db, user_id, per_page=5)
 
-        total_equipments = db.query(Equipment).filter(
-            Equipment.user_id == user_id
-        ).count()
+    # Liste légère (id, nom) : sert au compteur et au filtre de l'export
+    equipments_list = db.query(Equipment.id, Equipment.name).filter(
+        Equipment.user_id == user_id
+    ).all()
 
-        # Récupérer les alertes
-        alerts = get_user_alerts(user_id)
+    # Récupérer les alertes
+    alerts = get_user_alerts(user_id)
 
-        # Récupérer l'objectif quotidien (avec valeur par défaut si None)
-        daily_goal = user.daily_goal if user.daily_goal else 5.0
+    # Récupérer l'objectif quotidien (avec valeur par défaut si None)
+    daily_goal = user.daily_goal if user.daily_goal else 5.0
 
-        return render_template('home.html',
-                               total_today=round(total_today, 2),
-                               recent_usages=recent_usages,
-                               total_equipments=total_equipments,
-                               alerts=alerts,
-                               daily_goal=daily_goal)
-    finally:
-        db.close()
+    return render_template('home.html',
+                           total_today=round(total_today, 2),
+                           recent_usages=recent_usages,
+                           total_equipments=len(equipments_list),
+                           equipments=equipments_list,
+                           alerts=alerts,
+                           daily_goal=daily_goal)
 
 # Liste des équipements
 @app.route('/equipments')
 @login_required
 def equipments():
     user_id = session['user_id']
-    db = get_session()
+    db = get_db()
 
-    try:
-        equipments_list = db.query(Equipment).filter(
-            Equipment.user_id == user_id
-        ).all()
+    equipments_list = db.query(Equipment).filter(
+        Equipment.user_id == user_id
+    ).all()
 
-        return render_template('equipments.html', equipments=equipments_list)
-    finally:
-        db.close()
+    return render_template('equipments.html', equipments=equipments_list)
 
 
 # Ajouter un équipement
@@ -183,21 +194,18 @@ def add_equipment():
             flash('Tous les champs sont obligatoires.', 'danger')
             return redirect(url_for('add_equipment'))
 
-        db = get_session()
-        try:
-            new_equipment = Equipment(
-                user_id=session['user_id'],
-                name=name,
-                puissance_watts=float(puissance),
-                category=category
-            )
-            db.add(new_equipment)
-            db.commit()
-
-            flash(f'Équipement "{name}" ajouté !', 'success')
-            return redirect(url_for('equipments'))
-        finally:
-            db.close()
+        db = get_db()
+        new_equipment = Equipment(
+            user_id=session['user_id'],
+            name=name,
+            puissance_watts=float(puissance),
+            category=category
+        )
+        db.add(new_equipment)
+        db.commit()
+
+        flash(f'Équipement "{name}" ajouté !', 'success')
+        return redirect(url_for('equipments'))
 
     return render_template('add_equipment.html')
 
@@ -207,138 +215,213 @@ def add_equipment():
 @login_required
 def add_usage():
     user_id = session['user_id']
-    db = get_session()
+    db = get_db()
 
-    try:
-        if request.method == 'POST':
-            equipment_id = request.form.get('equipment_id')
-            heures = request.form.get('heures', 0)
-            minutes = request.form.get('minutes', 0)
-            consommation_manuelle = request.form.get('consommation_kwh')
-            date_str = request.form.get('date')
-
-            if not equipment_id:
-                flash('Sélectionnez un équipement.', 'danger')
-                return redirect(url_for('add_usage'))
-
-            equipment = db.query(Equipment).filter(
-                Equipment.id == equipment_id,
-                Equipment.user_id == user_id
-            ).first()
+    if request.method == 'POST':
+        equipment_id = request.form.get('equipment_id')
+        heures = request.form.get('heures', 0)
+        minutes = request.form.get('minutes', 0)
+        consommation_manuelle = request.form.get('consommation_kwh')
+        date_str = request.form.get('date')
 
-            if not equipment:
-                flash('Équipement introuvable.', 'danger')
-                return redirect(url_for('add_usage'))
+        if not equipment_id:
+            flash('Sélectionnez un équipement.', 'danger')
+            return redirect(url_for('add_usage'))
 
-            duree_heures = float(heures) + (float(minutes) / 60)
+        equipment = db.query(Equipment).filter(
+            Equipment.id == equipment_id,
+            Equipment.user_id == user_id
+        ).first()
 
-            if consommation_manuelle and float(consommation_manuelle) > 0:
-                consommation = float(consommation_manuelle)
-            else:
-                consommation = (equipment.puissance_watts * duree_heures) / 1000
+        if not equipment:
+            flash('Équipement introuvable.', 'danger')
+            return redirect(url_for('add_usage'))
 
-            usage_date = datetime.strptime(date_str, '%Y-%m-%dT%H:%M') if date_str else datetime.now()
+        duree_heures = float(heures) + (float(minutes) / 60)
 
-            new_usage = Usage(
-                user_id=user_id,
-                equipment_id=equipment_id,
-                date=usage_date,
-                duree_heures=duree_heures,
-                consommation_kwh=consommation
-            )
+        if consommation_manuelle and float(consommation_manuelle) > 0:
+            consommation = float(consommation_manuelle)
+        else:
+            consommation = (equipment.puissance_watts * duree_heures) / 1000
 
-            db.add(new_usage)
-            db.commit()
+        usage_date = datetime.strptime(date_str, '%Y-%m-%dT%H:%M') if date_str else datetime.now()
 
-            # Vérifier les alertes de surconsommation
-            from utils.calculations import check_daily_consumption_alert
-            check_daily_consumption_alert(user_id)
+        new_usage = Usage(
+            user_id=user_id,
+            equipment_id=equipment.id,
+            date=usage_date,
+            duree_heures=duree_heures,
+            consommation_kwh=consommation
+        )
 
-            flash(f'Enregistré : {round(consommation, 2)} kWh', 'success')
-            return redirect(url_for('home'))
+        db.add(new_usage)
+        days = record_usage_added(db, new_usage)
+        version = bump_data_version(db, user_id)
+        deltas = [usage_delta(new_usage, 1)]
+        db.commit()
+        update_series(user_id, version, deltas)
 
-        equipments_list = db.query(Equipment).filter(
-            Equipment.user_id == user_id
-        ).all()
+        # Alertes de surconsommation / d'objectif : évaluées hors de la requête
+        enqueue_alert_check(user_id, days)
 
-        return render_template('add_usage.html', equipments=equipments_list)
-    finally:
-        db.close()
+        flash(f'Enregistré : {round(consommation, 2)} kWh', 'success')
+        return redirect(url_for('home'))
 
+    equipments_list = db.query(Equipment).filter(
+        Equipment.user_id == user_id
+    ).all()
 
-# Statistiques
-@app.route('/statistics')
+    return render_template('add_usage.html', equipments=equipments_list)
+
+
+# Importer des utilisations en masse (CSV / JSON)
+@app.route('/import_usages', methods=['GET', 'POST'])
 @login_required
-def statistics():
+def import_usages():
     user_id = session['user_id']
-    db = get_session()
+
+    if request.method == 'POST':
+        from utils.importer import import_usages as import_rows, iter_rows, detect_format
+
+        uploaded = request.files.get('file')
+        if not uploaded or not uploaded.filename:
+            flash('Sélectionnez un fichier.', 'danger')
+            return redirect(url_for('import_usages'))
+
+        # Lecture en flux : le fichier n'est jamais chargé entièrement en mémoire
+        stream = io.TextIOWrapper(uploaded.stream, encoding='utf-8-sig', newline='')
+        report = import_rows(get_db(), user_id, iter_rows(stream, detect_format(uploaded.filename)))
+
+        if report['unreadable_from'] is not None:
+            flash(f"Fichier illisible à partir de la ligne {report['unreadable_from']} : vérifiez le format "
+                  f"(CSV ou JSON, encodé en UTF-8). Les lignes précédentes ont été traitées.", 'danger')
+        flash(f"{report['imported']} utilisations importées.", 'success' if report['imported'] else 'info')
+        if report['error_count']:
+            details = ' ; '.join(f'ligne {line} : {message}' for line, message in report['errors'][:5])
+            flash(f"{report['error_count']} lignes ignorées ({details}).", 'warning')
+        if report['alerts']:
+            flash(f"{report['alerts']} alertes de surconsommation créées.", 'warning')
+        return redirect(url_for('home'))
+
+    equipments_list = get_db().query(Equipment).filter(
+        Equipment.user_id == user_id
+    ).all()
+
+    return render_template('import_usages.html', equipments=equipments_list)
+
+
+def parse_usage_filters(args):
+    """Filtres de l'historique et de l'export (?debut=&fin=&equipement=) ; ValueError s'ils sont invalides"""
+    filters = {}
+    if args.get('debut'):
+        filters['start'] = datetime.strptime(args['debut'], '%Y-%m-%d')
+    if args.get('fin'):
+        # Date de fin incluse
+        filters['end'] = datetime.strptime(args['fin'], '%Y-%m-%d') + timedelta(days=1)
+    if args.get('equipement'):
+        filters['equipment_id'] = int(args['equipement'])
+    return filters
+
+
+# Historique des utilisations (pagination par clé, voir utils/history.py)
+@app.route('/history')
+@login_required
+def history():
+    user_id = session['user_id']
+    db = get_db()
+
+    from utils.history import history_page
 
     try:
-        from utils.calculations import (
-            get_weekly_data,
-            get_monthly_data,
-            get_equipment_breakdown
-        )
+        filters = parse_usage_filters(request.args)
+        usages, next_cursor = history_page(db, user_id, request.args.get('apres') or None, **filters)
+    except ValueError:
+        flash("Filtres de l'historique invalides.", 'danger')
+        return redirect(url_for('history'))
 
-        # Statistiques globales
-        total_usages = db.query(Usage).filter(Usage.user_id == user_id).count()
-        total_kwh = db.query(Usage).filter(Usage.user_id == user_id).all()
-        total_consommation = sum(u.consommation_kwh for u in total_kwh)
-
-        # Cette semaine
-        today = datetime.now()
-        week_start = today - timedelta(days=today.weekday())
-        week_usages = db.query(Usage).filter(
-            Usage.user_id == user_id,
-            Usage.date >= week_start
-        ).all()
-        week_total = sum(u.consommation_kwh for u in week_usages)
-
-        # Ce mois
-        month_start = today.replace(day=1)
-        month_usages = db.query(Usage).filter(
-            Usage.user_id == user_id,
-            Usage.date >= month_start
-        ).all()
-        month_total = sum(u.consommation_kwh for u in month_usages)
-
-        # Données pour graphiques
-        weekly_data = get_weekly_data(user_id)
-        monthly_data = get_monthly_data(user_id)
-        equipment_data = get_equipment_breakdown(user_id)
-
-        return render_template('statistics.html',
-                               total_usages=total_usages,
-                               total_consommation=round(total_consommation, 2),
-                               week_total=round(week_total, 2),
-                               month_total=round(month_total, 2),
-                               weekly_data=weekly_data,
-                               monthly_data=monthly_data,
-                               equipment_data=equipment_data)
-    finally:
-        db.close()
+    equipments_list = db.query(Equipment.id, Equipment.name).filter(
+        Equipment.user_id == user_id
+    ).all()
 
-# Supprimer un équipement
-@app.route('/delete_equipment/<int:equipment_id>')
+    # Filtres à conserver dans les liens de pagination et d'export
+    filter_args = {key: request.args[key] for key in ('debut', 'fin', 'equipement') if request.args.get(key)}
+
+    return render_template('history.html',
+                           usages=usages,
+                           next_cursor=next_cursor,
+                           is_first_page=not request.args.get('apres'),
+                           equipments=equipments_list,
+                           filter_args=filter_args)
+
+
+# Exporter l'historique d'utilisations (CSV / JSON), envoyé en flux
+@app.route('/export_usages')
 @login_required
-def delete_equipment(equipment_id):
+def export_usages():
     user_id = session['user_id']
-    db = get_session()
 
+    from utils.exporter import export_usages as generate_export
+
+    file_format = 'json' if request.args.get('format') == 'json' else 'csv'
     try:
-        equipment = db.query(Equipment).filter(
-            Equipment.id == equipment_id,
-            Equipment.user_id == user_id
-        ).first()
+        filters = parse_usage_filters(request.args)
+    except ValueError:
+        flash("Filtres d'export invalides.", 'danger')
+        return redirect(url_for('home'))
 
-        if equipment:
-            db.delete(equipment)
-            db.commit()
-            flash(f'Équipement "{equipment.name}" supprimé.', 'success')
-        else:
-            flash('Équipement introuvable.', 'danger')
-    finally:
-        db.close()
+    filename = f"utilisations_{datetime.now().strftime('%Y%m%d')}.{file_format}"
+    mimetype = 'application/json' if file_format == 'json' else 'text/csv'
+    return Response(
+        stream_with_context(generate_export(user_id, file_format, **filters)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+# Pages d'analyse : gabarits sans données, remplis par l'API JSON (/api/...)
+def shell_page(template, **context):
+    """Page rendue sans aucun calcul (gabarit, paramètres d'URL, session)
+
+    L'ETag est celui du contenu : le navigateur revalide (If-None-Match) et reçoit 304
+    tant que la page ne change pas ; les données arrivent par les réponses de l'API.
+    """
+    response = app.make_response(render_template(template, **context))
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+
+# Statistiques
+@app.route('/statistics')
+@login_required
+def statistics():
+    # Répartition par équipement : tout l'historique ou le mois en cours (graphique lu via /api/breakdown)
+    breakdown_period = 'mois' if request.args.get('repartition') == 'mois' else 'tout'
+    return shell_page('statistics.html', breakdown_period=breakdown_period)
+
+# Supprimer un équipement
+@app.route('/delete_equipment/<int:equipment_id>')
+@login_required
+def delete_equipment(equipment_id):
+    user_id = session['user_id']
+    db = get_db()
+
+    equipment = db.query(Equipment).filter(
+        Equipment.id == equipment_id,
+        Equipment.user_id == user_id
+    ).first()
+
+    if equipment:
+        # Les utilisations de l'équipement et leur cumul journalier disparaissent avec lui
+        db.query(Usage).filter(Usage.equipment_id == equipment.id).delete(synchronize_session=False)
+        days = record_equipment_removed(db, equipment.id)
+        bump_data_version(db, user_id)
+        db.delete(equipment)
+        db.commit()
+        enqueue_alert_check(user_id, days)
+        flash(f'Équipement "{equipment.name}" supprimé.', 'success')
+    else:
+        flash('Équipement introuvable.', 'danger')
 
     return redirect(url_for('equipments'))
 
@@ -348,30 +431,28 @@ def delete_equipment(equipment_id):
 @login_required
 def edit_equipment(equipment_id):
     user_id = session['user_id']
-    db = get_session()
+    db = get_db()
 
-    try:
-        equipment = db.query(Equipment).filter(
-            Equipment.id == equipment_id,
-            Equipment.user_id == user_id
-        ).first()
+    equipment = db.query(Equipment).filter(
+        Equipment.id == equipment_id,
+        Equipment.user_id == user_id
+    ).first()
 
-        if not equipment:
-            flash('Équipement introuvable.', 'danger')
-            return redirect(url_for('equipments'))
+    if not equipment:
+        flash('Équipement introuvable.', 'danger')
+        return redirect(url_for('equipments'))
 
-        if request.method == 'POST':
-            equipment.name = request.form.get('name')
-            equipment.puissance_watts = float(request.form.get('puissance'))
-            equipment.category = request.form.get('category')
-            db.commit()
+    if request.method == 'POST':
+        equipment.name = request.form.get('name')
+        equipment.puissance_watts = float(request.form.get('puissance'))
+        equipment.category = request.form.get('category')
+        bump_data_version(db, user_id)  # le nom apparaît dans la répartition
+        db.commit()
 
-            flash(f'Équipement "{equipment.name}" modifié.', 'success')
-            return redirect(url_for('equipments'))
+        flash(f'Équipement "{equipment.name}" modifié.', 'success')
+        return redirect(url_for('equipments'))
 
-        return render_template('edit_equipment.html', equipment=equipment)
-    finally:
-        db.close()
+    return render_template('edit_equipment.html', equipment=equipment)
 
 
 # Supprimer une utilisation
@@ -379,22 +460,24 @@ def edit_equipment(equipment_id):
 @login_required
 def delete_usage(usage_id):
     user_id = session['user_id']
-    db = get_session()
-
-    try:
-        usage = db.query(Usage).filter(
-            Usage.id == usage_id,
-            Usage.user_id == user_id
-        ).first()
-
-        if usage:
-            db.delete(usage)
-            db.commit()
-            flash('Utilisation supprimée.', 'success')
-        else:
-            flash('Utilisation introuvable.', 'danger')
-    finally:
-        db.close()
+    db = get_db()
+
+    usage = db.query(Usage).filter(
+        Usage.id == usage_id,
+        Usage.user_id == user_id
+    ).first()
+
+    if usage:
+        days = record_usage_removed(db, usage)
+        version = bump_data_version(db, user_id)
+        deltas = [usage_delta(usage, -1)]
+        db.delete(usage)
+        db.commit()
+        update_series(user_id, version, deltas)
+        enqueue_alert_check(user_id, days)
+        flash('Utilisation supprimée.', 'success')
+    else:
+        flash('Utilisation introuvable.', 'danger')
 
     return redirect(url_for('home'))
 
@@ -404,36 +487,40 @@ def delete_usage(usage_id):
 @login_required
 def edit_usage(usage_id):
     user_id = session['user_id']
-    db = get_session()
-
-    try:
-        usage = db.query(Usage).filter(
-            Usage.id == usage_id,
-            Usage.user_id == user_id
-        ).first()
+    db = get_db()
 
-        if not usage:
-            flash('Utilisation introuvable.', 'danger')
-            return redirect(url_for('home'))
+    usage = db.query(Usage).filter(
+        Usage.id == usage_id,
+        Usage.user_id == user_id
+    ).first()
 
-        if request.method == 'POST':
-            heures = float(request.form.get('heures', 0))
-            minutes = float(request.form.get('minutes', 0))
-            usage.duree_heures = heures + (minutes / 60)
-            usage.consommation_kwh = float(request.form.get('consommation_kwh'))
-            usage.date = datetime.strptime(request.form.get('date'), '%Y-%m-%dT%H:%M')
-            db.commit()
+    if not usage:
+        flash('Utilisation introuvable.', 'danger')
+        return redirect(url_for('home'))
 
-            flash('Utilisation modifiée.', 'success')
-            return redirect(url_for('home'))
+    if request.method == 'POST':
+        heures = float(request.form.get('heures', 0))
+        minutes = float(request.form.get('minutes', 0))
+        days = record_usage_removed(db, usage)
+        deltas = [usage_delta(usage, -1)]
+        usage.duree_heures = heures + (minutes / 60)
+        usage.consommation_kwh = float(request.form.get('consommation_kwh'))
+        usage.date = datetime.strptime(request.form.get('date'), '%Y-%m-%dT%H:%M')
+        days += record_usage_added(db, usage)
+        deltas.append(usage_delta(usage, 1))
+        version = bump_data_version(db, user_id)
+        db.commit()
+        update_series(user_id, version, deltas)
+        enqueue_alert_check(user_id, days)
+
+        flash('Utilisation modifiée.', 'success')
+        return redirect(url_for('home'))
 
-        equipments_list = db.query(Equipment).filter(
-            Equipment.user_id == user_id
-        ).all()
+    equipments_list = db.query(Equipment).filter(
+        Equipment.user_id == user_id
+    ).all()
 
-        return render_template('edit_usage.html', usage=usage, equipments=equipments_list)
-    finally:
-        db.close()
+    return render_template('edit_usage.html', usage=usage, equipments=equipments_list)
 
 def admin_required(f):
     @wraps(f)
@@ -453,39 +540,91 @@ def admin_required(f):
 @app.route('/admin')
 @admin_required
 def admin_panel():
-    db = get_session()
+    db = get_db()
 
-    try:
-        # Utilisateurs en attente de validation
-        pending_users = db.query(User).filter(User.is_approved == 0).all()
+    from utils.admin import user_page, user_activity
+    from utils.profiler import is_enabled, slow_queries
+
+    # Recherche par début du nom d'utilisateur ou de l'email, commune aux deux listes
+    search = request.args.get('q', '').strip()
+
+    # Utilisateurs en attente de validation, puis approuvés : une page de chaque
+    pending_users, pending_next = user_page(db, approved=False, search=search,
+                                            after=request.args.get('attente_apres'))
+    approved_users, approved_next = user_page(db, approved=True, search=search,
+                                              after=request.args.get('apres'))
+
+    # Équipements, utilisations, dernière activité et kWh sur 30 jours : une requête pour la page
+    activity = user_activity(db, [user.id for user in pending_users + approved_users])
+
+    return render_template('admin_panel.html',
+                           pending_users=pending_users,
+                           pending_next=pending_next,
+                           approved_users=approved_users,
+                           approved_next=approved_next,
+                           activity=activity,
+                           search=search,
+                           profiler_enabled=is_enabled(),
+                           slow_queries=slow_queries())
+
+
+# Approuver ou rejeter plusieurs utilisateurs en attente (une seule requête)
+@app.route('/admin/bulk', methods=['POST'])
+@admin_required
+def admin_bulk():
+    db = get_db()
+
+    from utils.admin import approve_users, reject_users
 
-        # Tous les utilisateurs approuvés
-        approved_users = db.query(User).filter(User.is_approved == 1).all()
+    user_ids = [int(user_id) for user_id in request.form.getlist('user_ids') if user_id.isdigit()]
+    action = request.form.get('action')
 
-        return render_template('admin_panel.html',
-                               pending_users=pending_users,
-                               approved_users=approved_users)
-    finally:
-        db.close()
+    if not user_ids:
+        flash('Aucun utilisateur sélectionné.', 'warning')
+    elif action == 'approve':
+        flash(f'{approve_users(db, user_ids)} utilisateur(s) approuvé(s).', 'success')
+    elif action == 'reject':
+        flash(f'{reject_users(db, user_ids)} utilisateur(s) rejeté(s) et supprimé(s).', 'success')
+    else:
+        flash('Action inconnue.', 'danger')
+
+    return redirect(url_for('admin_panel', q=request.form.get('q') or None))
+
+
+# Mesures de performance du processus, au format texte Prometheus
+@app.route('/admin/metrics')
+@admin_required
+def admin_metrics():
+    from utils.metrics import get_metrics
+
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
+
+
+# Vider le tampon des instructions SQL lentes
+@app.route('/admin/slow_queries/clear', methods=['POST'])
+@admin_required
+def clear_slow_queries():
+    from utils.profiler import clear
+
+    clear()
+    flash('Requêtes lentes effacées.', 'success')
+    return redirect(url_for('admin_panel'))
 
 
 # Approuver un utilisateur
 @app.route('/admin/approve/<int:user_id>')
 @admin_required
 def approve_user(user_id):
-    db = get_session()
+    db = get_db()
 
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
+    user = db.query(User).filter(User.id == user_id).first()
 
-        if user:
-            user.is_approved = 1
-            db.commit()
-            flash(f'Utilisateur "{user.username}" approuvé !', 'success')
-        else:
-            flash('Utilisateur introuvable.', 'danger')
-    finally:
-        db.close()
+    if user:
+        user.is_approved = 1
+        db.commit()
+        flash(f'Utilisateur "{user.username}" approuvé !', 'success')
+    else:
+        flash('Utilisateur introuvable.', 'danger')
 
     return redirect(url_for('admin_panel'))
 
@@ -494,19 +633,16 @@ def approve_user(user_id):
 @app.route('/admin/reject/<int:user_id>')
 @admin_required
 def reject_user(user_id):
-    db = get_session()
+    db = get_db()
 
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
+    user = db.query(User).filter(User.id == user_id).first()
 
-        if user:
-            db.delete(user)
-            db.commit()
-            flash(f'Utilisateur "{user.username}" rejeté et supprimé.', 'success')
-        else:
-            flash('Utilisateur introuvable.', 'danger')
-    finally:
-        db.close()
+    if user:
+        db.delete(user)
+        db.commit()
+        flash(f'Utilisateur "{user.username}" rejeté et supprimé.', 'success')
+    else:
+        flash('Utilisateur introuvable.', 'danger')
 
     return redirect(url_for('admin_panel'))
 
@@ -515,19 +651,30 @@ def reject_user(user_id):
 @app.route('/admin/delete/<int:user_id>')
 @admin_required
 def delete_user(user_id):
-    db = get_session()
-
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
-
-        if user and user.id != session['user_id']:  # Ne peut pas se supprimer lui-même
-            db.delete(user)
-            db.commit()
-            flash(f'Utilisateur "{user.username}" supprimé.', 'success')
-        else:
-            flash('Impossible de supprimer cet utilisateur.', 'danger')
-    finally:
-        db.close()
+    db = get_db()
+
+    user = db.query(User).filter(User.id == user_id).first()
+
+    if user and user.id != session['user_id']:  # Ne peut pas se supprimer lui-même
+        from models.database import Alert, ArchivedMonth, DailyConsumption, DailyTotal, PredictionModel
+        from utils.archive import remove_archive_files
+
+        # Les relations ne sont pas en cascade (clés étrangères NOT NULL) : lignes dépendantes
+        # d'abord, utilisations avant équipements, puis l'utilisateur
+        for model in (Usage, DailyConsumption, DailyTotal, Equipment, Prediction, PredictionModel,
+                      Alert, ArchivedMonth):
+            db.query(model).filter(model.user_id == user.id).delete(synchronize_session=False)
+        db.delete(user)
+        db.commit()
+        invalidate_user(user.id)
+        # Fichiers d'archive après le commit : un échec de la suppression les laisse en place
+        remove_archive_files(user.id)
+        if config.ANALYTICS_BACKEND == 'series':
+            from utils.series import get_store
+            get_store().discard(user.id)
+        flash(f'Utilisateur "{user.username}" supprimé.', 'success')
+    else:
+        flash('Impossible de supprimer cet utilisateur.', 'danger')
 
     return redirect(url_for('admin_panel'))
 
@@ -537,70 +684,63 @@ def delete_user(user_id):
 @login_required
 def profile():
     user_id = session['user_id']
-    db = get_session()
+    db = get_db()
 
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
-
-        if request.method == 'POST':
-            action = request.form.get('action')
-
-            # Modifier le nom d'utilisateur et email
-            if action == 'update_info':
-                new_username = request.form.get('username')
-                new_email = request.form.get('email')
-
-                # Vérifier si le nom d'utilisateur ou email existe déjà
-                existing = db.query(User).filter(
-                    User.id != user_id,
-                    (User.username == new_username) | (User.email == new_email)
-                ).first()
-
-                if existing:
-                    flash('Ce nom d\'utilisateur ou email est déjà utilisé.', 'danger')
-                else:
-                    user.username = new_username
-                    user.email = new_email
-                    session['username'] = new_username
-                    db.commit()
-                    flash('Informations mises à jour !', 'success')
-
-            # Changer le mot de passe
-            elif action == 'change_password':
-                current_password = request.form.get('current_password')
-                new_password = request.form.get('new_password')
-                confirm_password = request.form.get('confirm_password')
-
-                if not user.check_password(current_password):
-                    flash('Mot de passe actuel incorrect.', 'danger')
-                elif new_password != confirm_password:
-                    flash('Les nouveaux mots de passe ne correspondent pas.', 'danger')
-                elif len(new_password) < 4:
-                    flash('Le mot de passe doit contenir au moins 4 caractères.', 'warning')
-                else:
-                    user.set_password(new_password)
-                    db.commit()
-                    flash('Mot de passe changé avec succès !', 'success')
-
-        return render_template('profile.html', user=user)
-    finally:
-        db.close()
+    if request.method == 'POST':
+        action = request.form.get('action')
 
+        # Modifier le nom d'utilisateur et email
+        if action == 'update_info':
+            new_username = request.form.get('username')
+            new_email = request.form.get('email')
 
-# Prédictions
-@app.route('/predictions')
-@login_required
-def predictions():
-    user_id = session['user_id']
+            # Vérifier si le nom d'utilisateur ou email existe déjà
+            existing = db.query(User).filter(
+                User.id != user_id,
+                (User.username == new_username) | (User.email == new_email)
+            ).first()
 
-    from utils.calculations import predict_next_week
+            if existing:
+                flash('Ce nom d\'utilisateur ou email est déjà utilisé.', 'danger')
+            else:
+                db.query(User).filter(User.id == user_id).update({
+                    User.username: new_username,
+                    User.email: new_email,
+                }, synchronize_session=False)
+                session['username'] = new_username
+                db.commit()
+                invalidate_user(user_id)
+                flash('Informations mises à jour !', 'success')
+
+        # Changer le mot de passe
+        elif action == 'change_password':
+            current_password = request.form.get('current_password')
+            new_password = request.form.get('new_password')
+            confirm_password = request.form.get('confirm_password')
+
+            # Seul cas qui a besoin du mot de passe : objet User complet
+            user = db.query(User).filter(User.id == user_id).first()
+
+            if not user.check_password(current_password):
+                flash('Mot de passe actuel incorrect.', 'danger')
+            elif new_password != confirm_password:
+                flash('Les nouveaux mots de passe ne correspondent pas.', 'danger')
+            elif len(new_password) < 4:
+                flash('Le mot de passe doit contenir au moins 4 caractères.', 'warning')
+            else:
+                user.set_password(new_password)
+                db.commit()
+                flash('Mot de passe changé avec succès !', 'success')
 
-    predictions_data = predict_next_week(user_id)
+    return render_template('profile.html', user=get_current_user())
 
-    if predictions_data is None:
-        flash('Pas assez de données pour faire des prédictions (minimum 7 jours).', 'warning')
 
-    return render_template('predictions.html', predictions=predictions_data)
+# Prédictions
+@app.route('/predictions')
+@login_required
+def predictions():
+    # Prévisions lues via /api/predictions (seul chemin qui peut charger NumPy)
+    return shell_page('predictions.html')
 
 
 # Marquer alerte comme lue
@@ -617,37 +757,186 @@ def mark_alert_read(alert_id):
 @login_required
 def settings():
     user_id = session['user_id']
-    db = get_session()
+    db = get_db()
 
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
+    if request.method == 'POST':
+        db.query(User).filter(User.id == user_id).update({
+            User.alert_threshold: float(request.form.get('alert_threshold', 10)),
+            User.daily_goal: float(request.form.get('daily_goal', 5)),
+        }, synchronize_session=False)
+        db.commit()
+        invalidate_user(user_id)
 
-        if request.method == 'POST':
-            user.alert_threshold = float(request.form.get('alert_threshold', 10))
-            user.daily_goal = float(request.form.get('daily_goal', 5))
-            db.commit()
-            flash('Paramètres enregistrés !', 'success')
-            return redirect(url_for('settings'))
+        # Les alertes du jour suivent les nouveaux seuils
+        enqueue_alert_check(user_id, [datetime.now().date()])
+        flash('Paramètres enregistrés !', 'success')
+        return redirect(url_for('settings'))
 
-        return render_template('settings.html', user=user)
-    finally:
-        db.close()
+    return render_template('settings.html', user=get_current_user())
 
 
 # Comparaisons mensuelles
 @app.route('/comparisons')
 @login_required
 def comparisons():
-    user_id = session['user_id']
+    from utils.calculations import COMPARISON_MONTHS
+
+    months = request.args.get('mois', 6, type=int)
+    if months not in COMPARISON_MONTHS:
+        months = 6
+
+    # Mois, statistiques et tableau lus via /api/comparison
+    return shell_page('comparisons.html', months=months, month_choices=COMPARISON_MONTHS)
+
+
+# API JSON des séries de graphiques
+# Chaque réponse porte un ETag dérivé de la version des données de l'utilisateur :
+# si le navigateur renvoie le même (If-None-Match), réponse 304 sans aucun calcul.
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Vous devez être connecté.'}), 401
+        return f(*args, **kwargs)
+
+    return decorated_function
+
 
-    from utils.calculations import get_monthly_comparison, get_comparison_stats
+def conditional_json(compute, *etag_parts):
+    """Réponse JSON de compute(), ou 304 si l'ETag envoyé par le client est à jour"""
+    etag = analytics_etag(session['user_id'], request.path, *etag_parts)
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(compute())
+    response.set_etag(etag)
+    # Toujours revalider : l'ETag change dès que les données changent
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-    monthly_data = get_monthly_comparison(user_id, months=6)
-    comparison_stats = get_comparison_stats(user_id)
 
-    return render_template('comparisons.html',
-                           monthly_data=monthly_data,
-                           stats=comparison_stats)
+@app.route('/api/summary')
+@api_login_required
+def api_summary():
+    from utils.calculations import get_dashboard_snapshot
+
+    def compute():
+        snapshot = get_dashboard_snapshot(session['user_id'])
+        return {key: snapshot[key] for key in ('total_usages', 'total_consommation', 'week_total', 'month_total')}
+
+    return conditional_json(compute)
+
+
+@app.route('/api/weekly')
+@api_login_required
+def api_weekly():
+    from utils.calculations import get_dashboard_snapshot
+    return conditional_json(lambda: get_dashboard_snapshot(session['user_id'])['weekly_data'])
+
+
+@app.route('/api/monthly')
+@api_login_required
+def api_monthly():
+    from utils.calculations import get_dashboard_snapshot
+    return conditional_json(lambda: get_dashboard_snapshot(session['user_id'])['monthly_data'])
+
+
+@app.route('/api/breakdown')
+@api_login_required
+def api_breakdown():
+    from utils.calculations import get_dashboard_snapshot
+
+    key = 'equipment_data_month' if request.args.get('repartition') == 'mois' else 'equipment_data'
+    return conditional_json(lambda: get_dashboard_snapshot(session['user_id'])[key], key)
+
+
+@app.route('/api/comparison')
+@api_login_required
+def api_comparison():
+    from utils.calculations import get_comparisons, COMPARISON_MONTHS
+
+    months = request.args.get('mois', 6, type=int)
+    if months not in COMPARISON_MONTHS:
+        months = 6
+
+    def compute():
+        monthly_data, stats = get_comparisons(session['user_id'], months=months)
+        return {'months': monthly_data, 'stats': stats}
+
+    return conditional_json(compute, months)
+
+
+@app.route('/api/predictions')
+@api_login_required
+def api_predictions():
+    from utils.calculations import get_stored_predictions
+
+    def compute():
+        predictions_data = get_stored_predictions(session['user_id'])
+        if predictions_data is None:
+            from utils.predictions import predict_next_week
+            predictions_data = predict_next_week(session['user_id'])
+        return predictions_data
+
+    return conditional_json(compute)
+
+
+@app.route('/api/history')
+@api_login_required
+def api_history():
+    from utils.history import history_page, PER_PAGE, MAX_PER_PAGE
+
+    per_page = min(max(request.args.get('limite', PER_PAGE, type=int), 1), MAX_PER_PAGE)
+    try:
+        filters = parse_usage_filters(request.args)
+        usages, next_cursor = history_page(get_db(), session['user_id'], request.args.get('apres') or None,
+                                           per_page, **filters)
+    except ValueError:
+        return jsonify({'error': 'Filtres invalides.'}), 400
+
+    return jsonify({
+        'usages': [{
+            'id': usage.id,
+            'equipment_id': usage.equipment_id,
+            'equipment': usage.equipment,
+            'date': usage.date.strftime('%Y-%m-%d %H:%M:%S'),
+            'duree_heures': usage.duree_heures,
+            'consommation_kwh': round(usage.consommation_kwh, 4),
+        } for usage in usages],
+        'next': next_cursor,
+    })
+
+
+def warm_up(include_ml=None):
+    """Précharge ce que la première requête de chaque worker paierait sinon
+
+    À appeler avant de créer les workers (serveur pre-fork) : modules d'analyse,
+    gabarits compilés et, si include_ml (config.PRELOAD_ML par défaut), NumPy et
+    le chemin des prédictions.
+    """
+    if include_ml is None:
+        include_ml = config.PRELOAD_ML
+
+    import utils.calculations  # noqa: F401
+    if include_ml:
+        import utils.predictions  # noqa: F401
+
+    for template in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template)
+
+
+def create_app(preload=False, include_ml=None):
+    """Point d'entrée des serveurs WSGI (serve.py, ou gunicorn 'app:create_app(preload=True)')
+
+    Avec preload, l'application est préchargée (warm_up) dans le processus parent, avant
+    la création des workers. Les connexions ouvertes pendant le chargement sont fermées :
+    aucun worker n'hérite d'une connexion SQLite du parent.
+    """
+    if preload:
+        warm_up(include_ml)
+    dispose_engine()
+    return app
+
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""Microbenchmarks des fonctions d'analyse (utils/calculations.py) sur des données synthétiques
+
+Chaque palier est généré par benchmarks/seed.py dans une base temporaire. Pour chaque
+fonction : durée (médiane et minimum sur --repeat exécutions, après une exécution
+d'échauffement), nombre de requêtes SQL et pic mémoire Python (tracemalloc, mesuré à part).
+Les fonctions mises en cache sont appelées sans le cache (__wrapped__) : on mesure le calcul.
+
+Usage : python -m benchmarks.calculations [--tiers small,medium,large] [--repeat 5] [--backend sql|series]
+                                          [--json] [--output fichier.json] [--compare ancien.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import config
+from benchmarks.seed import seed_database
+from models.database import get_session, count_queries, dispose_engine, PredictionModel
+from utils.alerts import evaluate_alerts
+from utils.calculations import get_dashboard_snapshot, get_comparisons
+
+# Paliers : (utilisateurs, équipements par utilisateur, utilisations par utilisateur, jours couverts)
+TIERS = {
+    'small': (3, 5, 100, 30),
+    'medium': (3, 10, 2000, 365),
+    'large': (3, 20, 20000, 1095),
+}
+
+
+def _uncached(func):
+    return getattr(func, '__wrapped__', func)
+
+
+def _predict(user_id):
+    # Le modèle enregistré est supprimé à chaque appel : on mesure l'ajustement de la tendance
+    from utils.predictions import predict_next_week
+
+    db = get_session()
+    try:
+        db.query(PredictionModel).filter(PredictionModel.user_id == user_id).delete()
+        db.commit()
+    finally:
+        db.close()
+    return _uncached(predict_next_week)(user_id)
+
+
+def _evaluate_alerts(user_id):
+    db = get_session()
+    try:
+        return evaluate_alerts(db, [datetime.now().date()], [user_id])
+    finally:
+        db.close()
+
+
+# (nom, fonction(user_id)) : les fonctions appelées par les pages, sources des totaux
+# selon --backend (calculations.aggregations())
+FUNCTIONS = [
+    # Pages Statistiques et Accueil, API /api/weekly, /api/monthly, /api/breakdown
+    ('get_dashboard_snapshot', _uncached(get_dashboard_snapshot)),
+    ('predict_next_week', _predict),
+    # get_monthly_comparison et get_comparison_stats lisent le cache de get_comparisons
+    ('get_comparisons (6 mois)', lambda user_id: _uncached(get_comparisons)(user_id, 6)),
+    ('get_comparisons (36 mois)', lambda user_id: _uncached(get_comparisons)(user_id, 36)),
+    ('evaluate_alerts', _evaluate_alerts),
+]
+
+
+def measure(func, user_id, repeat):
+    """{'median_ms', 'min_ms', 'queries', 'peak_kib'} pour func(user_id)"""
+    func(user_id)  # échauffement (connexions, imports, cache de requêtes compilées)
+
+    durations = []
+    for _ in range(repeat):
+        with count_queries() as counter:
+            start = time.perf_counter()
+            func(user_id)
+            durations.append((time.perf_counter() - start) * 1000)
+
+    # Mesure mémoire séparée : tracemalloc ralentit l'exécution
+    tracemalloc.start()
+    try:
+        func(user_id)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'median_ms': statistics.median(durations),
+        'min_ms': min(durations),
+        'queries': counter.count,
+        'peak_kib': peak / 1024,
+    }
+
+
+def run_tier(directory, name, repeat):
+    users, equipments, usages, days = TIERS[name]
+    user_ids = seed_database(os.path.join(directory, f'{name}.db'), users, equipments, usages, days)
+    try:
+        # Premier utilisateur : mêmes volumes pour tous, graine fixe
+        return {func_name: measure(func, user_ids[0], repeat) for func_name, func in FUNCTIONS}
+    finally:
+        dispose_engine()
+
+
+def print_results(results, previous=None):
+    for tier, functions in results.items():
+        _, equipments, usages, days = TIERS[tier]
+        print(f"\n{tier} : {equipments} équipements, {usages} utilisations sur {days} jours")
+        header = f"{'Fonction':<26}{'médiane':>11}{'min':>11}{'requêtes':>10}{'pic mém.':>12}"
+        print(header + (f"{'vs réf.':>10}" if previous else ''))
+        for func_name, result in functions.items():
+            line = (f"{func_name:<26}{result['median_ms']:>8.2f} ms{result['min_ms']:>8.2f} ms"
+                    f"{result['queries']:>10}{result['peak_kib']:>8.0f} KiB")
+            reference = (previous or {}).get(tier, {}).get(func_name)
+            if reference and reference['median_ms']:
+                line += f"{result['median_ms'] / reference['median_ms']:>9.2f}x"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tiers', default=','.join(TIERS), help="paliers séparés par des virgules")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--backend', choices=('sql', 'series'), default=config.ANALYTICS_BACKEND,
+                        help="source des totaux (config.ANALYTICS_BACKEND)")
+    parser.add_argument('--json', action='store_true', help='sortie JSON (comparaison entre versions)')
+    parser.add_argument('--output', help="enregistre aussi les résultats JSON dans ce fichier")
+    parser.add_argument('--compare', help="résultats JSON de référence : affiche le rapport des médianes")
+    args = parser.parse_args()
+
+    tiers = [tier.strip() for tier in args.tiers.split(',') if tier.strip()]
+    unknown = [tier for tier in tiers if tier not in TIERS]
+    if unknown:
+        parser.error(f"palier inconnu : {', '.join(unknown)} (choix : {', '.join(TIERS)})")
+
+    config.ANALYTICS_BACKEND = args.backend
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {tier: run_tier(tmp, tier, args.repeat) for tier in tiers}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print_results(results, previous)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Vérifie que les pages d'analyse émettent un nombre constant de requêtes SQL
+
+Usage : python -m benchmarks.query_counts   (sur la base configurée, ECOSENSE_DATABASE_URL)
+Code de sortie 1 si une fonction dépasse son budget pour au moins un utilisateur.
+
+Avec ECOSENSE_ANALYTICS_BACKEND=series, la série de l'utilisateur est chargée par un premier
+appel non compté : le budget porte sur un appel à chaud (la seule requête est alors la lecture
+de users.data_version, qui vérifie que la série est à jour).
+"""
+import sys
+import config
+from models.database import get_session, count_queries, User
+from utils.calculations import (get_dashboard_snapshot, DASHBOARD_SNAPSHOT_QUERIES,
+                                get_comparisons, COMPARISON_MONTHS, COMPARISONS_QUERIES)
+
+# (nom, fonction(user_id), nombre de requêtes attendu)
+CHECKS = [
+    ('get_dashboard_snapshot', get_dashboard_snapshot, DASHBOARD_SNAPSHOT_QUERIES),
+] + [
+    (f'get_comparisons ({months} mois)',
+     lambda user_id, months=months: get_comparisons.__wrapped__(user_id, months),
+     COMPARISONS_QUERIES)
+    for months in COMPARISON_MONTHS
+]
+
+
+def main():
+    db = get_session()
+    try:
+        user_ids = [user_id for (user_id,) in db.query(User.id).order_by(User.id)]
+    finally:
+        db.close()
+
+    failures = 0
+    for name, func, expected in CHECKS:
+        counts = set()
+        for user_id in user_ids:
+            # Fonction non mise en cache : on mesure le calcul lui-même
+            compute = getattr(func, '__wrapped__', func)
+            if config.ANALYTICS_BACKEND == 'series':
+                compute(user_id)  # chargement de la série (une fois par version des données)
+            with count_queries() as counter:
+                compute(user_id)
+            counts.add(counter.count)
+            if counter.count != expected:
+                failures += 1
+                print(f"❌ {name}(user_id={user_id}) : {counter.count} requêtes (attendu {expected})")
+                for statement in counter.statements:
+                    print(f"      {statement}")
+        print(f"{name} : {sorted(counts)} requête(s) pour {len(user_ids)} utilisateurs (attendu {expected})")
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Remplit une base SQLite de travail avec des données synthétiques
+
+Utilisateurs approuvés, équipements par utilisateur et utilisations réparties au hasard
+(graine fixe : mêmes données d'une exécution à l'autre) sur les `days` derniers jours.
+Les cumuls journaliers sont reconstruits à la fin.
+
+Usage : python -m benchmarks.seed <fichier.db> [--users 10] [--equipments 5] [--usages 1000] [--days 365]
+"""
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+import config
+from models.database import Base, get_engine, get_session, dispose_engine, User, Equipment, Usage
+from utils.rollup import rebuild_rollup
+
+CATEGORIES = ('Cuisine', 'Climatisation', 'Éclairage', 'Multimédia', 'Divers')
+BATCH_SIZE = 10000
+
+
+def use_database(path):
+    """Fait pointer le moteur du processus sur la base SQLite `path`"""
+    dispose_engine()
+    config.DATABASE_URL = 'sqlite:///' + os.path.abspath(path)
+    return get_engine()
+
+
+def seed_database(path, users=10, equipments=5, usages=1000, days=365, seed=0):
+    """Crée la base `path` (qui ne doit pas exister) et la remplit ; retourne les ids des utilisateurs"""
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} existe déjà : choisissez un nouveau fichier")
+
+    engine = use_database(path)
+    Base.metadata.create_all(engine)
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+
+    db = get_session()
+    try:
+        accounts = []
+        for i in range(users):
+            user = User(username=f'bench{i:05d}', email=f'bench{i:05d}@example.com', is_approved=1)
+            user.password_hash = 'x'  # compte de mesure : pas de connexion
+            accounts.append(user)
+        db.add_all(accounts)
+        db.flush()
+
+        owned = {}
+        for user in accounts:
+            owned[user.id] = [
+                Equipment(user_id=user.id, name=f'Équipement {j}', category=rng.choice(CATEGORIES),
+                          puissance_watts=rng.choice((60, 150, 500, 1200, 2000)))
+                for j in range(equipments)
+            ]
+            db.add_all(owned[user.id])
+        db.flush()
+
+        rows = []
+        for user in accounts:
+            for _ in range(usages):
+                equipment = rng.choice(owned[user.id])
+                hours = round(rng.uniform(0.25, 8), 2)
+                rows.append({
+                    'user_id': user.id,
+                    'equipment_id': equipment.id,
+                    'date': now - timedelta(seconds=rng.randrange(days * 86400)),
+                    'duree_heures': hours,
+                    'consommation_kwh': equipment.puissance_watts * hours / 1000,
+                })
+                if len(rows) >= BATCH_SIZE:
+                    db.execute(Usage.__table__.insert(), rows)
+                    rows = []
+        if rows:
+            db.execute(Usage.__table__.insert(), rows)
+        db.commit()
+
+        rebuild_rollup(db)
+        return [user.id for user in accounts]
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help="fichier SQLite à créer")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--equipments', type=int, default=5, help="équipements par utilisateur")
+    parser.add_argument('--usages', type=int, default=1000, help="utilisations par utilisateur")
+    parser.add_argument('--days', type=int, default=365, help="période couverte, en jours")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        user_ids = seed_database(args.path, args.users, args.equipments, args.usages, args.days, args.seed)
+    except FileExistsError as error:
+        parser.error(str(error))
+    print(f"{len(user_ids)} utilisateurs, {args.equipments} équipements et {args.usages} utilisations "
+          f"chacun sur {args.days} jours : {args.path}")
+
+
+if __name__ == '__main__':
+    main()
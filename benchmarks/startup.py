@@ -0,0 +1,117 @@
+"""Temps de démarrage : import de app et première requête de chaque page
+
+Chaque mesure est faite dans un processus Python neuf (comme un nouveau worker),
+sur une base SQLite temporaire remplie de données de démonstration.
+
+Usage : python -m benchmarks.startup [--runs 5] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ['/home', '/statistics', '/comparisons', '/predictions']
+
+# Exécuté dans un processus neuf : affiche les durées en millisecondes (JSON)
+IMPORT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app
+print(json.dumps({'import_app': (time.perf_counter() - start) * 1000}))
+"""
+
+ROUTE_SCRIPT = """
+import json, sys, time
+import app
+client = app.app.test_client()
+with client.session_transaction() as session:
+    session['user_id'] = 1
+    session['username'] = 'bench'
+    session['is_admin'] = 0
+route = sys.argv[1]
+start = time.perf_counter()
+first = client.get(route)
+first_ms = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+client.get(route)
+second_ms = (time.perf_counter() - start) * 1000
+assert first.status_code == 200, first.status_code
+print(json.dumps({'first': first_ms, 'second': second_ms}))
+"""
+
+
+def create_database(path):
+    """Base de démonstration : 1 utilisateur, 5 équipements, 90 jours d'utilisations"""
+    os.environ['ECOSENSE_DATABASE_URL'] = 'sqlite:///' + path
+    sys.path.insert(0, ROOT)
+    from models.database import init_db, get_session, dispose_engine, User, Equipment, Usage
+    from utils.rollup import rebuild_rollup
+
+    init_db()
+    db = get_session()
+    try:
+        user = User(username='bench', email='bench@example.com', is_approved=1)
+        user.set_password('bench')
+        db.add(user)
+        db.flush()
+        equipments = [Equipment(user_id=user.id, name=f'Équipement {i}', puissance_watts=100 * (i + 1),
+                                category='Divers') for i in range(5)]
+        db.add_all(equipments)
+        db.flush()
+        now = datetime.now()
+        for day in range(90):
+            for equipment in equipments:
+                db.add(Usage(user_id=user.id, equipment_id=equipment.id, date=now - timedelta(days=day),
+                             duree_heures=2, consommation_kwh=equipment.puissance_watts * 2 / 1000))
+        db.commit()
+        rebuild_rollup(db)
+    finally:
+        db.close()
+        dispose_engine()
+
+
+def run(script, env, *args):
+    output = subprocess.run([sys.executable, '-c', script, *args], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='sortie JSON (comparaison entre versions)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'startup.db')
+        create_database(path)
+        env = dict(os.environ, ECOSENSE_DATABASE_URL='sqlite:///' + path)
+
+        results = {'import_app': statistics.median(
+            run(IMPORT_SCRIPT, env)['import_app'] for _ in range(args.runs)
+        )}
+        for route in ROUTES:
+            samples = [run(ROUTE_SCRIPT, env, route) for _ in range(args.runs)]
+            results[route] = {
+                'first_request_ms': statistics.median(s['first'] for s in samples),
+                'second_request_ms': statistics.median(s['second'] for s in samples),
+            }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"import app : {results['import_app']:.1f} ms (médiane sur {args.runs} processus)")
+    print(f"{'Page':<15}{'1re requête':>15}{'2e requête':>15}")
+    for route in ROUTES:
+        print(f"{route:<15}{results[route]['first_request_ms']:>12.1f} ms"
+              f"{results[route]['second_request_ms']:>12.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
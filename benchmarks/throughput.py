@@ -0,0 +1,157 @@
+"""Débit HTTP : serveur de développement contre serveur de production (serve.py)
+
+Pour chaque serveur demandé, lance python serve.py sur une base synthétique temporaire,
+puis `concurrency` clients enchaînent pendant `duration` secondes les pages de ROUTES,
+chacun avec la session d'un utilisateur différent.
+
+Usage : python -m benchmarks.throughput [--servers dev gunicorn] [--workers 5] [--threads 4]
+                                        [--concurrency 16] [--duration 10] [--json]
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ['/home', '/statistics', '/comparisons', '/history', '/api/weekly', '/api/comparison?mois=12']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def session_cookies(user_ids):
+    """Cookies de session signés (comptes de mesure sans mot de passe)"""
+    from app import app
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return [serializer.dumps({'user_id': user_id, 'username': f'bench{user_id}', 'is_admin': 0})
+            for user_id in user_ids]
+
+
+def wait_ready(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"le serveur s'est arrêté (code {process.returncode})")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("le serveur ne répond pas")
+
+
+def client(port, cookie, stop_at, latencies, errors, offset):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    headers = {'Cookie': f'session={cookie}'}
+    i = offset
+    while time.monotonic() < stop_at:
+        route = ROUTES[i % len(ROUTES)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            connection.request('GET', route, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            elif response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            connection.close()
+            continue
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def measure(server, env, cookies, args):
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, 'serve.py'), '--server', server,
+               '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers), '--threads', str(args.threads)]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port, process)
+        # Première requête de chaque page hors mesure
+        client(port, cookies[0], time.monotonic() + 1, [], [], 0)
+
+        latencies, errors = [], []
+        stop_at = time.monotonic() + args.duration
+        threads = [threading.Thread(target=client, args=(port, cookies[i % len(cookies)], stop_at,
+                                                           latencies, errors, i))
+                   for i in range(args.concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--servers', nargs='+', default=['dev', 'gunicorn'], choices=['dev', 'gunicorn', 'waitress'])
+    parser.add_argument('--workers', type=int, default=2 * (os.cpu_count() or 1) + 1)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16, help="clients simultanés")
+    parser.add_argument('--duration', type=float, default=10, help="durée de chaque mesure, en secondes")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--usages', type=int, default=2000, help="utilisations par utilisateur")
+    parser.add_argument('--json', action='store_true', help='sortie JSON (comparaison entre versions)')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from benchmarks.seed import seed_database
+    from models.database import dispose_engine
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'throughput.db')
+        user_ids = seed_database(path, users=args.users, usages=args.usages)
+        dispose_engine()
+        cookies = session_cookies(user_ids)
+        env = dict(os.environ, ECOSENSE_DATABASE_URL='sqlite:///' + path,
+                   ECOSENSE_ARCHIVE_DIR=os.path.join(tmp, 'archives'))
+        for server in args.servers:
+            if server != 'dev' and importlib.util.find_spec(server) is None:
+                print(f"{server} n'est pas installé (pip install {server}) : mesure ignorée.", file=sys.stderr)
+                continue
+            results[server] = measure(server, env, cookies, args)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.concurrency} clients, {args.duration:g} s par serveur, "
+          f"gunicorn/waitress : {args.workers} processus x {args.threads} threads")
+    print(f"{'Serveur':<12}{'requêtes/s':>12}{'p50':>12}{'p95':>12}{'erreurs':>10}")
+    for server, result in results.items():
+        print(f"{server:<12}{result['requests_per_second']:>12.1f}{result['p50_ms']:>9.1f} ms"
+              f"{result['p95_ms']:>9.1f} ms{result['errors']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+
+# Configuration de l'application (surchargeable par variables d'environnement)
+
+# Base de données
+DATABASE_URL = os.environ.get('ECOSENSE_DATABASE_URL', 'sqlite:///database.db')
+DATABASE_ECHO = os.environ.get('ECOSENSE_DATABASE_ECHO', '0') == '1'
+
+# Pool de connexions (un seul moteur par processus)
+DB_POOL_SIZE = int(os.environ.get('ECOSENSE_DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('ECOSENSE_DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('ECOSENSE_DB_POOL_TIMEOUT', 30))
+
+# PRAGMA appliqués à chaque nouvelle connexion SQLite
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('ECOSENSE_SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('ECOSENSE_SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('ECOSENSE_SQLITE_CACHE_SIZE', -20000)),  # négatif = en Kio
+    'mmap_size': int(os.environ.get('ECOSENSE_SQLITE_MMAP_SIZE', 268435456)),  # 256 Mo
+    'busy_timeout': int(os.environ.get('ECOSENSE_SQLITE_BUSY_TIMEOUT', 5000)),  # en ms
+}
+
+# Cache des résultats d'analyse (utils/cache.py) : 'memory', 'redis' ou 'none'
+CACHE_BACKEND = os.environ.get('ECOSENSE_CACHE_BACKEND', 'memory')
+CACHE_MAX_ENTRIES = int(os.environ.get('ECOSENSE_CACHE_MAX_ENTRIES', 2048))
+CACHE_TTL = int(os.environ.get('ECOSENSE_CACHE_TTL', 600))  # en secondes
+CACHE_REDIS_URL = os.environ.get('ECOSENSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+# Ajustement de la tendance des prédictions (utils/forecast.py) : 'numpy' (forme close) ou 'sklearn'
+PREDICTION_BACKEND = os.environ.get('ECOSENSE_PREDICTION_BACKEND', 'numpy')
+
+# Évaluation des alertes (utils/alerts.py) : 'thread' (thread du processus, hors requête)
+# ou 'inline' (juste après le commit, dans la requête)
+ALERT_WORKER = os.environ.get('ECOSENSE_ALERT_WORKER', 'thread')
+
+# Préchargement de NumPy et du chemin des prédictions par app.warm_up()
+PRELOAD_ML = os.environ.get('ECOSENSE_PRELOAD_ML', '0') == '1'
+
+# Mesures par requête (utils/metrics.py) : durée, requêtes SQL, temps base, lignes lues
+METRICS_ENABLED = os.environ.get('ECOSENSE_METRICS', '1') == '1'
+# Requêtes plus lentes que ce seuil journalisées avec leurs instructions SQL (en ms)
+SLOW_REQUEST_MS = int(os.environ.get('ECOSENSE_SLOW_REQUEST_MS', 500))
+
+# Profilage des requêtes SQL lentes (utils/profiler.py), désactivé par défaut :
+# instructions plus lentes que SLOW_QUERY_MS gardées avec leur plan d'exécution
+QUERY_PROFILER = os.environ.get('ECOSENSE_QUERY_PROFILER', '0') == '1'
+SLOW_QUERY_MS = float(os.environ.get('ECOSENSE_SLOW_QUERY_MS', 50))
+SLOW_QUERY_BUFFER = int(os.environ.get('ECOSENSE_SLOW_QUERY_BUFFER', 100))
+
+# Source des totaux des fonctions d'analyse : 'sql' (daily_consumption, utils/aggregations.py)
+# ou 'series' (séries journalières NumPy en mémoire du processus, utils/series.py)
+ANALYTICS_BACKEND = os.environ.get('ECOSENSE_ANALYTICS_BACKEND', 'sql')
+SERIES_MAX_MB = int(os.environ.get('ECOSENSE_SERIES_MAX_MB', 64))  # mémoire des séries, en Mo
+
+# Archivage des anciennes utilisations (utils/archive.py) : fichiers en colonnes par utilisateur et par mois
+ARCHIVE_DIR = os.environ.get('ECOSENSE_ARCHIVE_DIR', 'archives')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ECOSENSE_ARCHIVE_AFTER_DAYS', 365))
+
+# Serveur de production (serve.py) : 'gunicorn' (pre-fork, plusieurs processus), 'waitress'
+# (un processus, plusieurs threads) ou 'dev' (serveur de développement de Flask)
+SERVER = os.environ.get('ECOSENSE_SERVER', 'gunicorn')
+BIND = os.environ.get('ECOSENSE_BIND', '127.0.0.1:8000')
+WORKERS = int(os.environ.get('ECOSENSE_WORKERS', 2 * (os.cpu_count() or 1) + 1))  # processus
+THREADS = int(os.environ.get('ECOSENSE_THREADS', 4))  # threads par processus
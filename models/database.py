@@ -1,8 +1,17 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from sqlalchemy import (create_engine, event, inspect, text, Column, Integer, String, Float, Date, DateTime,
+                        ForeignKey, Index, UniqueConstraint)
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
+from flask import g, has_app_context, session
 from werkzeug.security import generate_password_hash, check_password_hash
+import config
 
 Base = declarative_base()
 
@@ -20,6 +29,8 @@ class User(Base):
     is_approved = Column(Integer, default=0)
     alert_threshold = Column(Float, default=10.0)
     daily_goal = Column(Float, default=5.0)
+    # Incrémenté à chaque modification des utilisations/équipements (invalide le cache d'analyse)
+    data_version = Column(Integer, nullable=False, default=0, server_default='0')
 
     # Relations
     equipments = relationship('Equipment', back_populates='user', lazy='select')
@@ -44,6 +55,10 @@ class Equipment(Base):
     category = Column(String(50), nullable=False)
     date_added = Column(DateTime, default=datetime.now)
 
+    __table_args__ = (
+        Index('ix_equipments_user_id', 'user_id'),
+    )
+
     # Relations
     user = relationship('User', back_populates='equipments')
     usages = relationship('Usage', back_populates='equipment', lazy='select')
@@ -60,11 +75,53 @@ class Usage(Base):
     duree_heures = Column(Float, nullable=False)
     consommation_kwh = Column(Float, nullable=False)
 
+    __table_args__ = (
+        # Toutes les analyses filtrent par utilisateur puis par période
+        Index('ix_usages_user_id_date', 'user_id', 'date'),
+    )
+
     # Relations
     user = relationship('User', back_populates='usages')
     equipment = relationship('Equipment', back_populates='usages')
 
 
+# Table DailyConsumption : cumul journalier par utilisateur et équipement
+# (maintenu dans la même transaction que les modifications de Usage, voir utils/rollup.py)
+class DailyConsumption(Base):
+    __tablename__ = 'daily_consumption'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    equipment_id = Column(Integer, ForeignKey('equipments.id'), nullable=False)
+    day = Column(Date, nullable=False)
+    kwh = Column(Float, nullable=False, default=0.0)
+    hours = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Sert aussi d'index pour les lectures par utilisateur et période
+        UniqueConstraint('user_id', 'day', 'equipment_id', name='uq_daily_consumption_user_day_equipment'),
+    )
+
+
+# Table DailyTotal : consommation du jour par utilisateur, tous équipements confondus
+# (tenue à jour avec daily_consumption ; sert aux vérifications de seuil d'alerte)
+class DailyTotal(Base):
+    __tablename__ = 'daily_totals'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    day = Column(Date, nullable=False)
+    kwh = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'day', name='uq_daily_totals_user_day'),
+        # Balayage des alertes : jours donnés, tous utilisateurs confondus (utils/alerts.py)
+        Index('ix_daily_totals_day', 'day'),
+    )
+
+
 # Table Predictions
 class Prediction(Base):
     __tablename__ = 'predictions'
@@ -75,23 +132,248 @@ class Prediction(Base):
     consommation_prevue = Column(Float, nullable=False)
     date_created = Column(DateTime, default=datetime.now)
 
+    __table_args__ = (
+        Index('ix_predictions_user_id_date', 'user_id', 'date'),
+    )
+
     # Relations
     user = relationship('User', back_populates='predictions')
 
 
+# Table ArchivedMonths : mois d'utilisations déplacés de la table usages vers des fichiers
+# en colonnes (utils/archive.py) ; un résumé par utilisateur et par mois
+class ArchivedMonth(Base):
+    __tablename__ = 'archived_months'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    month = Column(Date, nullable=False)  # premier jour du mois
+    path = Column(String(255), nullable=False)  # relatif à config.ARCHIVE_DIR
+    usage_count = Column(Integer, nullable=False, default=0)
+    kwh = Column(Float, nullable=False, default=0.0)
+    hours = Column(Float, nullable=False, default=0.0)
+    date_created = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'month', name='uq_archived_months_user_month'),
+    )
+
+
+# Table PredictionModels : paramètres de la tendance ajustée par utilisateur (utils/forecast.py),
+# réutilisés tant que la version des données et le jour n'ont pas changé
+class PredictionModel(Base):
+    __tablename__ = 'prediction_models'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, unique=True)
+    data_version = Column(Integer, nullable=False)
+    fitted_on = Column(Date, nullable=False)
+    usage_count = Column(Integer, nullable=False)  # utilisations sur les 30 derniers jours
+    slope = Column(Float)  # None si pas assez de données
+    intercept = Column(Float)
+    n_points = Column(Integer, nullable=False, default=0)  # jours avec des données
+    date_created = Column(DateTime, default=datetime.now)
+
+
+# Moteur unique par processus (créé au premier besoin)
+_engine = None
+SessionLocal = sessionmaker()
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Applique les PRAGMA de config.SQLITE_PRAGMAS à chaque nouvelle connexion"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in config.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+# Lignes lues par thread, tous moteurs confondus (mesures par requête, utils/metrics.py ;
+# comptées seulement si config.METRICS_ENABLED)
+_fetch_stats = threading.local()
+
+
+def rows_fetched():
+    """Nombre de lignes lues depuis SQLite par le thread courant depuis son démarrage"""
+    return getattr(_fetch_stats, 'rows', 0)
+
+
+def _count_rows(rows):
+    _fetch_stats.rows = getattr(_fetch_stats, 'rows', 0) + rows
+
+
+class RowCountingCursor(sqlite3.Cursor):
+    """Curseur SQLite qui compte les lignes lues (voir rows_fetched)"""
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            _count_rows(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        _count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _count_rows(len(rows))
+        return rows
+
+
+class RowCountingConnection(sqlite3.Connection):
+    def cursor(self, factory=RowCountingCursor):
+        return super().cursor(factory)
+
+
+def get_engine():
+    """Retourne le moteur du processus, en le créant si nécessaire"""
+    global _engine
+    if _engine is None:
+        options = {'echo': config.DATABASE_ECHO}
+        if config.DATABASE_URL.startswith('sqlite'):
+            options['connect_args'] = {'check_same_thread': False}
+            # Comptage des lignes lues seulement si les mesures sont actives (coût par ligne)
+            if config.METRICS_ENABLED:
+                options['connect_args']['factory'] = RowCountingConnection
+        if config.DATABASE_URL not in ('sqlite://', 'sqlite:///:memory:'):
+            options.update(
+                poolclass=QueuePool,
+                pool_size=config.DB_POOL_SIZE,
+                max_overflow=config.DB_MAX_OVERFLOW,
+                pool_timeout=config.DB_POOL_TIMEOUT,
+                pool_pre_ping=True,
+            )
+
+        engine = create_engine(config.DATABASE_URL, **options)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', _apply_sqlite_pragmas)
+
+        SessionLocal.configure(bind=engine)
+        _engine = engine
+    return _engine
+
+
+def dispose_engine():
+    """Ferme toutes les connexions du pool (ex: changement de base, fin de script)"""
+    global _engine
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+def _reset_engine_after_fork():
+    # Processus enfant (worker d'un serveur pre-fork) : les connexions SQLite héritées
+    # appartiennent au parent. Elles sont abandonnées sans être fermées ni réutilisées ;
+    # le moteur du worker est recréé à la première requête.
+    global _engine
+    if _engine is not None:
+        _engine.dispose(close=False)
+        _engine = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_engine_after_fork)
+
+
 # Fonction d'initialisation de la base de données
 def init_db():
-    engine = create_engine('sqlite:///database.db', echo=False)
+    engine = get_engine()
     Base.metadata.create_all(engine)
     print("Base de données créée avec succès!")
     return engine
 
 
-# Fonction pour obtenir une session
+# Fonction pour obtenir une session indépendante (scripts, tâches hors requête)
 def get_session():
-    engine = create_engine('sqlite:///database.db', echo=False)
-    Session = sessionmaker(bind=engine)
-    return Session()
+    get_engine()
+    return SessionLocal()
+
+
+# Session liée à la requête Flask en cours (fermée par close_db en fin de requête)
+def get_db():
+    if 'db' not in g:
+        g.db = get_session()
+    return g.db
+
+
+def close_db(exception=None):
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+
+class QueryCounter:
+    """Compte les requêtes SQL exécutées par le moteur (voir count_queries)"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """with count_queries() as counter: ... puis counter.count"""
+    engine = get_engine()
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter._on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter._on_execute)
+
+
+@contextmanager
+def db_session():
+    """Réutilise la session de la requête si elle existe, sinon ouvre une session dédiée"""
+    if has_app_context():
+        yield get_db()
+    else:
+        db = get_session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+# Utilisateur courant : colonnes utiles seulement (ni password_hash ni relations),
+# lues une seule fois par requête et partagées entre app.py et utils/
+USER_COLUMNS = (User.id, User.username, User.email, User.date_created, User.is_admin, User.is_approved,
+                User.alert_threshold, User.daily_goal, User.data_version)
+
+
+def load_user(user_id):
+    """Ligne USER_COLUMNS de l'utilisateur (None s'il n'existe pas), mémorisée pour la requête Flask"""
+    if has_app_context():
+        users = g.setdefault('users', {})
+        if user_id in users:
+            return users[user_id]
+
+    with db_session() as db:
+        user = db.query(*USER_COLUMNS).filter(User.id == user_id).first()
+
+    if has_app_context():
+        g.users[user_id] = user
+    return user
+
+
+def get_current_user():
+    """Utilisateur connecté (session Flask), ou None"""
+    user_id = session.get('user_id')
+    return load_user(user_id) if user_id is not None else None
+
+
+def invalidate_user(user_id):
+    """À appeler après une modification de l'utilisateur : la prochaine lecture relit la base"""
+    if has_app_context():
+        g.get('users', {}).pop(user_id, None)
 
 
 # Table Alerts
@@ -104,10 +386,123 @@ class Alert(Base):
     alert_type = Column(String(50), nullable=False)  # 'warning', 'danger', 'info'
     is_read = Column(Integer, default=0)  # 0 = non lu, 1 = lu
     date_created = Column(DateTime, default=datetime.now)
+    day = Column(Date)  # jour de consommation concerné (alertes de seuil, voir utils/alerts.py)
+
+    __table_args__ = (
+        # Alertes non lues d'un utilisateur, les plus récentes d'abord
+        Index('ix_alerts_user_id_is_read_date_created', 'user_id', 'is_read', 'date_created'),
+        # Une seule alerte de chaque type par jour (les alertes sans jour ne sont pas concernées)
+        Index('uq_alerts_user_day_type', 'user_id', 'day', 'alert_type', unique=True),
+        # Alertes obsolètes des jours balayés, tous utilisateurs confondus
+        Index('ix_alerts_day', 'day'),
+    )
 
     # Relations
     user = relationship('User', backref='alerts', lazy='select')
 
 
+# Requêtes les plus fréquentes, utilisées pour vérifier les plans d'exécution
+HOT_QUERIES = {
+    'usages par utilisateur et période': (
+        "SELECT * FROM usages WHERE user_id = 1 AND date >= '2000-01-01' ORDER BY date DESC"
+    ),
+    'alertes non lues': (
+        "SELECT * FROM alerts WHERE user_id = 1 AND is_read = 0 ORDER BY date_created DESC LIMIT 5"
+    ),
+    'cumul journalier par utilisateur et période': (
+        "SELECT day, SUM(kwh) FROM daily_consumption WHERE user_id = 1 AND day >= '2000-01-01' GROUP BY day"
+    ),
+    'équipements par utilisateur': (
+        "SELECT * FROM equipments WHERE user_id = 1"
+    ),
+    'totaux des jours balayés (alertes)': (
+        "SELECT user_id, kwh FROM daily_totals WHERE day IN ('2000-01-01', '2000-01-02')"
+    ),
+    'alertes des jours balayés': (
+        "SELECT id FROM alerts WHERE day IN ('2000-01-01', '2000-01-02')"
+    ),
+}
+
+# Index remplacés par d'autres, supprimés des bases existantes par migrate_db
+# (ix_alerts_user_id_day : couvert par uq_alerts_user_day_type, de mêmes premières colonnes)
+SUPERSEDED_INDEXES = ('ix_alerts_user_id_day',)
+
+
+def explain_hot_queries(engine=None):
+    """Retourne le plan SQLite (EXPLAIN QUERY PLAN) de chaque requête de HOT_QUERIES"""
+    engine = engine or get_engine()
+    plans = {}
+    with engine.connect() as conn:
+        for name, sql in HOT_QUERIES.items():
+            try:
+                rows = conn.execute(text('EXPLAIN QUERY PLAN ' + sql)).fetchall()
+            except OperationalError:
+                plans[name] = ['(table absente)']
+                continue
+            plans[name] = [row[-1] for row in rows]
+    return plans
+
+
+def _print_plans(title, plans):
+    print(title)
+    for name, details in plans.items():
+        print(f"  - {name}")
+        for detail in details:
+            print(f"      {detail}")
+
+
+def migrate_db():
+    """Met à jour une base existante : tables, colonnes et index manquants, sans perte de données"""
+    engine = get_engine()
+    before = explain_hot_queries(engine)
+
+    Base.metadata.create_all(engine)  # tables manquantes uniquement
+
+    existing = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        # Colonnes ajoutées au modèle depuis la création de la table
+        known_columns = {column['name'] for column in existing.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in known_columns:
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                with engine.begin() as conn:
+                    conn.execute(text(ddl))
+                print(f"Colonne ajoutée : {table.name}.{column.name}")
+
+        known = {index['name'] for index in existing.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in known:
+                index.create(engine)
+                print(f"Index créé : {index.name}")
+
+    for table_name in existing.get_table_names():
+        for index in existing.get_indexes(table_name):
+            if index['name'] in SUPERSEDED_INDEXES:
+                with engine.begin() as conn:
+                    conn.execute(text(f"DROP INDEX {index['name']}"))
+                print(f"Index supprimé : {index['name']}")
+
+    after = explain_hot_queries(engine)
+    _print_plans("Plans avant migration :", before)
+    _print_plans("Plans après migration :", after)
+
+    # Chaque requête chaude doit passer par un index (SEARCH ... USING INDEX)
+    full_scans = [name for name, details in after.items()
+                  if not any('USING' in detail and 'INDEX' in detail for detail in details)]
+    if full_scans:
+        print(f"⚠️ Requêtes sans index : {', '.join(full_scans)}")
+    else:
+        print("Migration terminée : toutes les requêtes chaudes utilisent un index.")
+    return not full_scans
+
+
 if __name__ == '__main__':
-    init_db()
\ No newline at end of file
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        sys.exit(0 if migrate_db() else 1)
+    init_db()
@@ -0,0 +1,79 @@
+"""Serveur de production : plusieurs processus et threads sous un serveur WSGI standard
+
+Usage : python serve.py [--server gunicorn|waitress|dev] [--workers 5] [--threads 4] [--bind 127.0.0.1:8000]
+"""
+import argparse
+import config
+
+# Modes de service (valeurs par défaut : config.SERVER, WORKERS, THREADS, BIND).
+# - gunicorn : serveur pre-fork (Linux, macOS). L'application est chargée et préchargée
+#   (app.warm_up) une seule fois dans le processus maître, puis les workers sont créés par
+#   fork et partagent ces pages mémoire. Chaque worker sert ses requêtes avec `threads`
+#   threads (worker gthread). Le moteur SQLAlchemy est remis à zéro dans chaque enfant
+#   (models/database.py) : aucun worker ne réutilise une connexion SQLite du maître.
+# - waitress : un seul processus, `threads` threads (pour Windows, sans fork) ; --workers ignoré.
+# - dev : serveur de développement de Flask, comme python app.py (référence des mesures).
+#
+# Les serveurs gunicorn et waitress sont des dépendances optionnelles (pip install gunicorn).
+# L'état du processus (cache mémoire des analyses, séries, mesures, thread des alertes)
+# reste propre à chaque worker : ECOSENSE_CACHE_BACKEND=redis pour un cache partagé.
+
+
+def parse_bind(bind):
+    host, _, port = bind.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def run_gunicorn(bind, workers, threads, include_ml):
+    from gunicorn.app.base import BaseApplication
+
+    class EcoSenseApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', [bind])
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('preload_app', True)
+
+        def load(self):
+            from app import create_app
+
+            return create_app(preload=True, include_ml=include_ml)
+
+    EcoSenseApplication().run()
+
+
+def run_waitress(bind, workers, threads, include_ml):
+    from waitress import serve
+    from app import create_app
+
+    if workers > 1:
+        print("waitress : un seul processus, --workers ignoré.")
+    serve(create_app(preload=True, include_ml=include_ml), listen=bind, threads=threads)
+
+
+def run_dev(bind, workers, threads, include_ml):
+    from app import create_app
+
+    host, port = parse_bind(bind)
+    create_app().run(host=host, port=port, debug=True, use_reloader=False)
+
+
+SERVERS = {'gunicorn': run_gunicorn, 'waitress': run_waitress, 'dev': run_dev}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', choices=sorted(SERVERS), default=config.SERVER)
+    parser.add_argument('--bind', default=config.BIND, help="adresse:port d'écoute")
+    parser.add_argument('--workers', type=int, default=config.WORKERS, help="nombre de processus (gunicorn)")
+    parser.add_argument('--threads', type=int, default=config.THREADS, help="threads par processus")
+    parser.add_argument('--preload-ml', action='store_true', default=config.PRELOAD_ML,
+                        help="précharge aussi NumPy et les prédictions avant le fork")
+    args = parser.parse_args()
+
+    SERVERS[args.server](args.bind, max(args.workers, 1), max(args.threads, 1), args.preload_ml)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+// Séries des graphiques, lues depuis l'API JSON (/api/...).
+// Les réponses portent un ETag : le navigateur revalide avec If-None-Match et
+// reçoit 304 Not Modified tant que les données de l'utilisateur n'ont pas changé.
+function loadChartData(url) {
+    return fetch(url, {credentials: 'same-origin', headers: {'Accept': 'application/json'}})
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error('Erreur ' + response.status + ' : ' + url);
+            }
+            return response.json();
+        });
+}
+
+// Coût estimé d'une consommation (150 FCFA le kWh)
+function formatCost(kwh) {
+    return Math.round(kwh * 150) + ' FCFA';
+}
+
+function round2(value) {
+    return Math.round(value * 100) / 100;
+}
+
+function setText(id, text) {
+    document.getElementById(id).textContent = text;
+}
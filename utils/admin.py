@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, or_, select
+from models.database import DailyTotal, Equipment, User
+
+# Listes d'utilisateurs du panel d'administration.
+# Chaque liste est paginée par clé sur le nom d'utilisateur (unique) et filtrable par
+# préfixe du nom ou de l'email ; les indicateurs d'activité de la page sont calculés
+# en une seule requête groupée (cumul journalier daily_totals et nombre d'équipements).
+
+PER_PAGE = 25
+RECENT_DAYS = 30
+
+
+def _prefix(column, prefix):
+    """column commence par prefix, sous forme d'intervalle (utilise l'index unique de la colonne)"""
+    return (column >= prefix) & (column < prefix + '\uffff')
+
+
+def user_page(db, approved, search=None, after=None, per_page=PER_PAGE):
+    """Une page d'utilisateurs (colonnes utiles seulement), par nom d'utilisateur croissant
+
+    Retourne (lignes, nom d'utilisateur à passer en `after` pour la page suivante ou None).
+    """
+    query = db.query(
+        User.id, User.username, User.email, User.is_admin, User.date_created
+    ).filter(User.is_approved == (1 if approved else 0))
+    if search:
+        query = query.filter(or_(_prefix(User.username, search), _prefix(User.email, search)))
+    if after:
+        query = query.filter(User.username > after)
+
+    rows = query.order_by(User.username).limit(per_page + 1).all()
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return rows, rows[-1].username
+    return rows, None
+
+
+def user_activity(db, user_ids):
+    """Indicateurs par utilisateur : {id: {'equipments', 'usages', 'last_activity', 'kwh_recent'}}
+
+    Une seule requête groupée pour tous les utilisateurs de la page.
+    """
+    if not user_ids:
+        return {}
+    recent_start = datetime.now().date() - timedelta(days=RECENT_DAYS - 1)
+    equipment_count = select(func.count(Equipment.id)).where(
+        Equipment.user_id == User.id
+    ).scalar_subquery()
+
+    rows = db.query(
+        User.id,
+        equipment_count,
+        func.sum(DailyTotal.count),
+        func.max(DailyTotal.day),
+        func.sum(case((DailyTotal.day >= recent_start, DailyTotal.kwh), else_=0.0))
+    ).outerjoin(DailyTotal, DailyTotal.user_id == User.id).filter(
+        User.id.in_(user_ids)
+    ).group_by(User.id)
+
+    return {
+        user_id: {
+            'equipments': equipments,
+            'usages': usages or 0,
+            'last_activity': last_day,
+            'kwh_recent': round(kwh or 0.0, 2),
+        }
+        for user_id, equipments, usages, last_day, kwh in rows
+    }
+
+
+def approve_users(db, user_ids):
+    """Approuve les utilisateurs en attente donnés (un seul UPDATE) ; retourne le nombre approuvé"""
+    if not user_ids:
+        return 0
+    count = db.query(User).filter(User.id.in_(user_ids), User.is_approved == 0).update(
+        {User.is_approved: 1}, synchronize_session=False
+    )
+    db.commit()
+    return count
+
+
+def reject_users(db, user_ids):
+    """Supprime les utilisateurs en attente donnés (un seul DELETE) ; retourne le nombre supprimé
+
+    Un compte en attente ne peut pas se connecter : il n'a ni équipement ni utilisation.
+    """
+    if not user_ids:
+        return 0
+    count = db.query(User).filter(User.id.in_(user_ids), User.is_approved == 0).delete(
+        synchronize_session=False
+    )
+    db.commit()
+    return count
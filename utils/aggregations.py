@@ -0,0 +1,91 @@
+from datetime import datetime
+from sqlalchemy import case, func
+from models.database import DailyConsumption, Equipment
+
+# Agrégations de consommation calculées par SQLite (SUM / GROUP BY) sur le cumul
+# journalier daily_consumption : seuls les totaux par période remontent en Python,
+# et une année d'historique représente au plus ~365 jours par utilisateur.
+# Les bornes sont à la journée : start inclus, end exclu.
+
+
+def _as_day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _filter_period(query, user_id, start=None, end=None):
+    query = query.filter(DailyConsumption.user_id == user_id)
+    if start is not None:
+        query = query.filter(DailyConsumption.day >= _as_day(start))
+    if end is not None:
+        query = query.filter(DailyConsumption.day < _as_day(end))
+    return query
+
+
+def total_consumption(db, user_id, start=None, end=None):
+    """Consommation totale (kWh) sur [start, end[ (bornes optionnelles)"""
+    query = _filter_period(db.query(func.sum(DailyConsumption.kwh)), user_id, start, end)
+    return query.scalar() or 0.0
+
+
+def total_and_count(db, user_id, start=None, end=None):
+    """Consommation totale (kWh) et nombre d'utilisations sur [start, end["""
+    query = _filter_period(
+        db.query(func.sum(DailyConsumption.kwh), func.sum(DailyConsumption.count)),
+        user_id, start, end
+    )
+    total, count = query.one()
+    return total or 0.0, count or 0
+
+
+def daily_totals(db, user_id, start=None, end=None):
+    """Totaux par jour : {'YYYY-MM-DD': kWh}"""
+    query = _filter_period(
+        db.query(DailyConsumption.day, func.sum(DailyConsumption.kwh)),
+        user_id, start, end
+    ).group_by(DailyConsumption.day)
+    return {day.strftime('%Y-%m-%d'): total for day, total in query}
+
+
+def monthly_totals(db, user_id, start=None, end=None):
+    """Totaux par mois calendaire : {'YYYY-MM': kWh}"""
+    month = func.strftime('%Y-%m', DailyConsumption.day)
+    query = _filter_period(
+        db.query(month, func.sum(DailyConsumption.kwh)),
+        user_id, start, end
+    ).group_by(month)
+    return {row_month: total for row_month, total in query}
+
+
+def equipment_totals(db, user_id, start=None, end=None, limit=None):
+    """Totaux par équipement, du plus consommateur au moins consommateur : [(nom, kWh)]"""
+    total = func.sum(DailyConsumption.kwh)
+    query = _filter_period(
+        db.query(Equipment.name, total).join(Equipment, Equipment.id == DailyConsumption.equipment_id),
+        user_id, start, end
+    ).group_by(Equipment.name).order_by(total.desc(), Equipment.name)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def dashboard_rows(db, user_id, recent_start):
+    """Cumul par équipement, détaillé par jour à partir de recent_start : [(nom, 'YYYY-MM-DD' ou None, kWh, nombre)]
+
+    Les jours antérieurs à recent_start sont regroupés (jour = None) : le nombre de lignes
+    renvoyées dépend du nombre d'équipements, pas de la profondeur de l'historique.
+    """
+    recent_day = case(
+        (DailyConsumption.day >= _as_day(recent_start), func.date(DailyConsumption.day)),
+        else_=None
+    ).label('recent_day')
+    query = db.query(
+        Equipment.name,
+        recent_day,
+        func.sum(DailyConsumption.kwh),
+        func.sum(DailyConsumption.count)
+    ).outerjoin(
+        Equipment, Equipment.id == DailyConsumption.equipment_id
+    ).filter(
+        DailyConsumption.user_id == user_id
+    ).group_by(Equipment.name, recent_day)
+    return query.all()
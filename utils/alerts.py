@@ -0,0 +1,186 @@
+import argparse
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import case, exists, func, insert, or_, select
+from models.database import db_session, Alert, DailyTotal, User
+import config
+
+# Évaluation des alertes de consommation, hors du chemin des requêtes.
+#
+# Les alertes sont un état dérivé des totaux journaliers (table daily_totals) :
+# - alerte 'warning' pour un jour dont le total dépasse users.alert_threshold ;
+# - alerte 'info' pour un jour dont le total dépasse users.daily_goal.
+# evaluate_alerts() remet cet état en ordre pour un ensemble de jours (alertes manquantes
+# créées, alertes devenues fausses retirées), quel que soit le nombre d'utilisateurs.
+#
+# Les modifications d'utilisations et de seuils appellent enqueue_alert_check() après
+# leur commit : un thread du processus fait l'évaluation. La commande
+# `python -m utils.alerts` évalue tous les utilisateurs (à planifier, ex: cron) et
+# rattrape les vérifications perdues à l'arrêt d'un processus.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DAILY_GOAL = 5.0
+ALERT_TYPES = ('warning', 'info')
+
+
+def _day_label(day):
+    return "aujourd'hui" if day == datetime.now().date() else f"le {day.strftime('%d/%m/%Y')}"
+
+
+def _limit(alert_type_column):
+    """Seuil de l'utilisateur correspondant au type d'alerte (expression SQL)"""
+    return case(
+        (alert_type_column == 'warning', User.alert_threshold),
+        else_=func.coalesce(User.daily_goal, DEFAULT_DAILY_GOAL)
+    )
+
+
+def evaluate_alerts(db, days, user_ids=None):
+    """Crée les alertes manquantes et retire les alertes obsolètes des jours donnés
+
+    Une requête de lecture (totaux au-dessus d'un seuil, tous utilisateurs confondus),
+    un INSERT groupé (les doublons sont ignorés grâce à l'index unique
+    uq_alerts_user_day_type) et un DELETE. Retourne le nombre d'alertes créées.
+    """
+    days = sorted(set(days))
+    if not days:
+        return 0
+    goal = func.coalesce(User.daily_goal, DEFAULT_DAILY_GOAL)
+
+    # Jours au-dessus d'au moins un seuil
+    query = db.query(
+        DailyTotal.user_id, DailyTotal.day, DailyTotal.kwh, User.alert_threshold, goal
+    ).join(User, User.id == DailyTotal.user_id).filter(
+        DailyTotal.day.in_(days),
+        or_(DailyTotal.kwh > User.alert_threshold, DailyTotal.kwh > goal)
+    )
+    if user_ids is not None:
+        query = query.filter(DailyTotal.user_id.in_(user_ids))
+
+    now = datetime.now()
+    new_alerts = []
+    for user_id, day, kwh, threshold, daily_goal in query:
+        if threshold is not None and kwh > threshold:
+            new_alerts.append({
+                'user_id': user_id, 'day': day, 'alert_type': 'warning', 'is_read': 0, 'date_created': now,
+                'message': f"⚠️ Surconsommation détectée : {round(kwh, 2)} kWh {_day_label(day)} "
+                           f"(seuil : {threshold} kWh)",
+            })
+        if kwh > daily_goal:
+            new_alerts.append({
+                'user_id': user_id, 'day': day, 'alert_type': 'info', 'is_read': 0, 'date_created': now,
+                'message': f"🎯 Objectif quotidien dépassé : {round(kwh, 2)} kWh {_day_label(day)} "
+                           f"(objectif : {daily_goal} kWh)",
+            })
+
+    created = 0
+    if new_alerts:
+        created = db.execute(insert(Alert.__table__).prefix_with('OR IGNORE'), new_alerts).rowcount
+
+    # Alertes dont le jour n'est plus au-dessus du seuil (modification, suppression, seuil relevé)
+    still_over = exists(
+        select(DailyTotal.id).join(User, User.id == DailyTotal.user_id).where(
+            DailyTotal.user_id == Alert.user_id,
+            DailyTotal.day == Alert.day,
+            DailyTotal.kwh > _limit(Alert.alert_type)
+        )
+    )
+    obsolete = db.query(Alert).filter(
+        Alert.day.in_(days),
+        Alert.alert_type.in_(ALERT_TYPES),
+        ~still_over
+    )
+    if user_ids is not None:
+        obsolete = obsolete.filter(Alert.user_id.in_(user_ids))
+    obsolete.delete(synchronize_session=False)
+
+    db.commit()
+    return created
+
+
+def sweep(days=1):
+    """Évalue les alertes de tous les utilisateurs pour les `days` derniers jours (aujourd'hui compris)"""
+    today = datetime.now().date()
+    with db_session() as db:
+        return evaluate_alerts(db, [today - timedelta(days=i) for i in range(days)])
+
+
+class AlertWorker:
+    """Thread d'évaluation des alertes alimenté par une file (un par processus)
+
+    Les demandes en attente sont regroupées : une seule évaluation pour tous les
+    utilisateurs et jours accumulés pendant l'évaluation précédente.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.processed = 0
+
+    def _ensure_started(self):
+        # Démarrage paresseux : après le fork des workers d'un serveur pre-fork
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='alert-worker', daemon=True)
+                self._thread.start()
+
+    def submit(self, user_id, days):
+        self._ensure_started()
+        self._queue.put((user_id, set(days)))
+
+    def join(self):
+        """Attend que toutes les demandes soumises soient traitées"""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            user_ids = {user_id for user_id, _ in batch}
+            days = set().union(*(days for _, days in batch))
+            try:
+                with db_session() as db:
+                    evaluate_alerts(db, days, user_ids)
+            except Exception:
+                logger.exception('Échec de la vérification des alertes (%d utilisateurs)', len(user_ids))
+            finally:
+                self.processed += len(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+
+_worker = AlertWorker()
+
+
+def get_worker():
+    return _worker
+
+
+def enqueue_alert_check(user_id, days):
+    """À appeler après le commit d'une modification des totaux ou des seuils de l'utilisateur"""
+    days = set(days)
+    if not days:
+        return
+    if config.ALERT_WORKER == 'inline':
+        with db_session() as db:
+            evaluate_alerts(db, days, [user_id])
+        return
+    _worker.submit(user_id, days)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Évalue les alertes de consommation de tous les utilisateurs")
+    parser.add_argument('--days', type=int, default=1, help="nombre de jours évalués, aujourd'hui compris")
+    args = parser.parse_args()
+
+    created = sweep(args.days)
+    print(f"{created} alertes créées.")
@@ -0,0 +1,219 @@
+import argparse
+import os
+import shutil
+import uuid
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+import numpy as np
+from sqlalchemy import func
+from models.database import db_session, ArchivedMonth, Equipment, Usage
+from utils.history import archived_months_query
+import config
+
+# Archivage des anciennes utilisations.
+# Les utilisations des mois entièrement plus anciens que config.ARCHIVE_AFTER_DAYS quittent
+# la table usages pour des fichiers en colonnes, un dossier par utilisateur et par mois :
+# id, date, equipment_id, hours, kwh (.npy à largeur fixe, lus en mmap), triés par (date, id).
+# Une ligne archived_months résume chaque mois (nombre, kWh, heures, dossier).
+#
+# Les cumuls journaliers (daily_consumption, daily_totals) ne changent pas : les analyses
+# les lisent comme avant. Les lectures des utilisations elles-mêmes (reconstruction des
+# cumuls, export, historique) complètent la table par les archives.
+#
+# Chaque archivage d'un mois écrit un nouveau dossier puis remplace le résumé dans la même
+# transaction que la suppression des lignes : un arrêt en cours de route laisse au pire
+# un dossier orphelin, jamais de ligne perdue ou comptée deux fois.
+
+COLUMNS = ('id', 'date', 'equipment_id', 'hours', 'kwh')
+DTYPES = {'id': np.int64, 'date': 'datetime64[us]', 'equipment_id': np.int64,
+          'hours': np.float64, 'kwh': np.float64}
+DELETE_CHUNK = 500
+
+# Même champs que les lignes de utils/history.usage_rows_query, plus archived
+ArchivedUsage = namedtuple('ArchivedUsage',
+                           'id equipment_id equipment date duree_heures consommation_kwh archived')
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _as_datetime(day):
+    return day if isinstance(day, datetime) else datetime.combine(day, datetime.min.time())
+
+
+def _directory(relative_path):
+    return os.path.join(config.ARCHIVE_DIR, relative_path)
+
+
+def load_month(summary):
+    """Colonnes du mois archivé {nom: tableau NumPy en lecture seule (mmap)}"""
+    directory = _directory(summary.path)
+    return {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+
+
+def _write_month(relative_path, columns):
+    directory = _directory(relative_path)
+    os.makedirs(directory)
+    for name in COLUMNS:
+        np.save(os.path.join(directory, f'{name}.npy'), columns[name])
+
+
+def archive_month(db, user_id, month):
+    """Déplace les utilisations du mois (premier jour `month`) vers l'archive ; retourne leur nombre"""
+    start, end = _as_datetime(month), _as_datetime(_next_month(month))
+    rows = db.query(
+        Usage.id, Usage.date, Usage.equipment_id, Usage.duree_heures, Usage.consommation_kwh
+    ).filter(
+        Usage.user_id == user_id, Usage.date >= start, Usage.date < end
+    ).order_by(Usage.date, Usage.id).all()
+    if not rows:
+        return 0
+
+    columns = {name: np.array([row[i] for row in rows], dtype=DTYPES[name]) for i, name in enumerate(COLUMNS)}
+    summary = db.query(ArchivedMonth).filter(
+        ArchivedMonth.user_id == user_id, ArchivedMonth.month == month
+    ).first()
+    old_path = None
+    if summary is None:
+        summary = ArchivedMonth(user_id=user_id, month=month)
+        db.add(summary)
+    else:
+        # Utilisations ajoutées après un premier archivage du mois : fusion, puis nouveau tri
+        old_path = summary.path
+        existing = load_month(summary)
+        columns = {name: np.concatenate([existing[name], columns[name]]) for name in COLUMNS}
+        order = np.lexsort((columns['id'], columns['date']))
+        columns = {name: values[order] for name, values in columns.items()}
+
+    summary.path = f"{user_id}/{month.strftime('%Y-%m')}-{uuid.uuid4().hex[:8]}"
+    _write_month(summary.path, columns)
+    summary.usage_count = len(columns['id'])
+    summary.kwh = float(columns['kwh'].sum())
+    summary.hours = float(columns['hours'].sum())
+
+    ids = [row[0] for row in rows]
+    for i in range(0, len(ids), DELETE_CHUNK):
+        db.query(Usage).filter(Usage.id.in_(ids[i:i + DELETE_CHUNK])).delete(synchronize_session=False)
+    db.commit()
+
+    if old_path is not None:
+        shutil.rmtree(_directory(old_path), ignore_errors=True)
+    return len(rows)
+
+
+def archive_old_usages(db, older_than_days=None):
+    """Archive les mois entièrement antérieurs à aujourd'hui - older_than_days ; retourne (mois, utilisations)"""
+    if older_than_days is None:
+        older_than_days = config.ARCHIVE_AFTER_DAYS
+    cutoff = _month_start(datetime.now().date() - timedelta(days=older_than_days))
+
+    month = func.strftime('%Y-%m', Usage.date)
+    candidates = db.query(Usage.user_id, month).filter(
+        Usage.date < _as_datetime(cutoff)
+    ).group_by(Usage.user_id, month).all()
+
+    moved = 0
+    for user_id, year_month in candidates:
+        moved += archive_month(db, user_id, datetime.strptime(year_month, '%Y-%m').date())
+    return len(candidates), moved
+
+
+def _selected(columns, start, end, equipment_id, names):
+    """Masque des lignes dans [start, end[, de l'équipement demandé et d'un équipement existant"""
+    mask = np.isin(columns['equipment_id'], list(names))
+    if start is not None:
+        mask &= columns['date'] >= np.datetime64(_as_datetime(start), 'us')
+    if end is not None:
+        mask &= columns['date'] < np.datetime64(_as_datetime(end), 'us')
+    if equipment_id is not None:
+        mask &= columns['equipment_id'] == equipment_id
+    return mask
+
+
+def _rows(columns, indexes, names):
+    dates = columns['date'][indexes].astype(object)
+    for i, usage_date in zip(indexes, dates):
+        equipment_id = int(columns['equipment_id'][i])
+        yield ArchivedUsage(int(columns['id'][i]), equipment_id, names[equipment_id], usage_date,
+                            float(columns['hours'][i]), float(columns['kwh'][i]), True)
+
+
+def _equipment_names(db, user_id):
+    # Les utilisations d'un équipement supprimé depuis l'archivage sont ignorées
+    return dict(db.query(Equipment.id, Equipment.name).filter(Equipment.user_id == user_id))
+
+
+def iter_archived_usages(db, user_id, start=None, end=None, equipment_id=None, months=None):
+    """Utilisations archivées (ArchivedUsage) par (date, id) croissants ; start inclus, end exclu"""
+    names = _equipment_names(db, user_id)
+    if months is None:
+        months = archived_months_query(db, user_id, start, end).all()
+    for summary in months:
+        columns = load_month(summary)
+        yield from _rows(columns, np.flatnonzero(_selected(columns, start, end, equipment_id, names)), names)
+
+
+def archived_page_before(db, user_id, months, last=None, limit=50, start=None, end=None, equipment_id=None):
+    """Au plus `limit` utilisations archivées antérieures à la clé (date, id) `last`, les plus récentes d'abord"""
+    names = _equipment_names(db, user_id)
+    result = []
+    for summary in sorted(months, key=lambda m: m.month, reverse=True):
+        if last is not None and _as_datetime(summary.month) > last[0]:
+            continue
+        columns = load_month(summary)
+        mask = _selected(columns, start, end, equipment_id, names)
+        if last is not None:
+            last_date = np.datetime64(last[0], 'us')
+            mask &= (columns['date'] < last_date) | ((columns['date'] == last_date) & (columns['id'] < last[1]))
+        indexes = np.flatnonzero(mask)[::-1][:limit - len(result)]
+        result.extend(_rows(columns, indexes, names))
+        if len(result) >= limit:
+            break
+    return result
+
+
+def archived_daily(db, user_id=None):
+    """Cumuls journaliers des archives : [(user_id, equipment_id, jour, kWh, heures, nombre)]"""
+    query = db.query(ArchivedMonth)
+    if user_id is not None:
+        query = query.filter(ArchivedMonth.user_id == user_id)
+
+    result = []
+    equipment_ids = {}
+    for summary in query.order_by(ArchivedMonth.user_id, ArchivedMonth.month):
+        if summary.user_id not in equipment_ids:
+            equipment_ids[summary.user_id] = set(_equipment_names(db, summary.user_id))
+        columns = load_month(summary)
+        mask = np.isin(columns['equipment_id'], list(equipment_ids[summary.user_id]))
+        days = columns['date'][mask].astype('datetime64[D]')
+        keys, groups = np.unique(np.stack([columns['equipment_id'][mask], days.astype(np.int64)], axis=1),
+                                 axis=0, return_inverse=True)
+        groups = groups.ravel()
+        kwh = np.bincount(groups, weights=columns['kwh'][mask], minlength=len(keys))
+        hours = np.bincount(groups, weights=columns['hours'][mask], minlength=len(keys))
+        counts = np.bincount(groups, minlength=len(keys))
+        for (equipment_id, day), day_kwh, day_hours, count in zip(keys, kwh, hours, counts):
+            result.append((summary.user_id, int(equipment_id), date(1970, 1, 1) + timedelta(days=int(day)),
+                           float(day_kwh), float(day_hours), int(count)))
+    return result
+
+
+def remove_archive_files(user_id):
+    """Supprime les fichiers d'archive de l'utilisateur (après le commit de sa suppression)"""
+    shutil.rmtree(_directory(str(user_id)), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Archive les utilisations anciennes (fichiers en colonnes par mois)")
+    parser.add_argument('--older-than-days', type=int, default=config.ARCHIVE_AFTER_DAYS,
+                        help="âge minimal, en jours : seuls les mois entièrement plus anciens sont archivés")
+    args = parser.parse_args()
+
+    with db_session() as db:
+        months, moved = archive_old_usages(db, args.older_than_days)
+    print(f"{moved} utilisations archivées ({months} mois) dans {config.ARCHIVE_DIR}.")
@@ -0,0 +1,107 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import func
+from models.database import get_session, DailyConsumption, Prediction, User
+from utils.forecast import fit_linear_trends
+
+# Prévisions de nuit pour tous les utilisateurs approuvés, enregistrées dans la table predictions.
+# Les utilisateurs sont traités par paquets : une requête agrégée par paquet, un ajustement
+# vectorisé sur la matrice utilisateurs × jours, puis une insertion groupée des 7 jours prévus.
+
+HISTORY_DAYS = 30
+FORECAST_DAYS = 7
+MIN_USAGES = 7
+
+
+def _forecast_chunk(db, user_ids, today):
+    """Calcule et enregistre les prévisions d'un paquet d'utilisateurs ; retourne le nombre de lignes"""
+    start = (today - timedelta(days=HISTORY_DAYS)).date()
+    # Fenêtre bornée : les usages datés au-delà de l'horizon des prévisions sont ignorés
+    last = today.date() + timedelta(days=FORECAST_DAYS)
+    rows = db.query(
+        DailyConsumption.user_id,
+        DailyConsumption.day,
+        func.sum(DailyConsumption.kwh),
+        func.sum(DailyConsumption.count)
+    ).filter(
+        DailyConsumption.user_id.in_(user_ids),
+        DailyConsumption.day >= start,
+        DailyConsumption.day <= last
+    ).group_by(DailyConsumption.user_id, DailyConsumption.day).all()
+
+    tomorrow = datetime.combine(today.date(), datetime.min.time()) + timedelta(days=1)
+    db.query(Prediction).filter(
+        Prediction.user_id.in_(user_ids),
+        Prediction.date >= tomorrow
+    ).delete(synchronize_session=False)
+
+    if not rows:
+        db.commit()
+        return 0
+
+    # Matrice utilisateurs × jours, au plus HISTORY_DAYS + FORECAST_DAYS + 1 colonnes
+    # (les usages datés dans le futur, jusqu'à l'horizon, étendent la fenêtre)
+    row_of = {user_id: i for i, user_id in enumerate(user_ids)}
+    n_days = max((day - start).days for _, day, _, _ in rows) + 1
+    values = np.zeros((len(user_ids), n_days))
+    present = np.zeros((len(user_ids), n_days), dtype=bool)
+    usage_counts = np.zeros(len(user_ids), dtype=int)
+    for user_id, day, kwh, count in rows:
+        i, j = row_of[user_id], (day - start).days
+        values[i, j] = kwh
+        present[i, j] = True
+        usage_counts[i] += count
+
+    slopes, intercepts, n_points = fit_linear_trends(values, present)
+    future_x = n_points[:, None] + np.arange(FORECAST_DAYS)
+    forecasts = np.round(np.maximum(0, intercepts[:, None] + slopes[:, None] * future_x), 2)
+
+    created = datetime.now()
+    new_rows = [
+        {
+            'user_id': user_id,
+            'date': tomorrow + timedelta(days=d),
+            'consommation_prevue': float(forecasts[i, d]),
+            'date_created': created,
+        }
+        for user_id, i in row_of.items() if usage_counts[i] >= MIN_USAGES
+        for d in range(FORECAST_DAYS)
+    ]
+    if new_rows:
+        db.bulk_insert_mappings(Prediction, new_rows)
+    db.commit()
+    return len(new_rows)
+
+
+def run_batch_forecast(chunk_size=1000, today=None):
+    """Prévisions des 7 prochains jours pour tous les utilisateurs approuvés"""
+    today = today or datetime.now()
+    started = time.perf_counter()
+    db = get_session()
+    try:
+        user_ids = [user_id for (user_id,) in db.query(User.id).filter(User.is_approved == 1).order_by(User.id)]
+        predictions = 0
+        for i in range(0, len(user_ids), chunk_size):
+            predictions += _forecast_chunk(db, user_ids[i:i + chunk_size], today)
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'users': len(user_ids),
+        'predictions': predictions,
+        'seconds': round(elapsed, 3),
+        'users_per_second': round(len(user_ids) / elapsed, 1) if elapsed else None,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prévisions de nuit pour tous les utilisateurs")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="utilisateurs par paquet")
+    args = parser.parse_args()
+
+    report = run_batch_forecast(chunk_size=args.chunk_size)
+    print(f"{report['users']} utilisateurs, {report['predictions']} prévisions enregistrées "
+          f"en {report['seconds']} s ({report['users_per_second']} utilisateurs/s)")
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+from models.database import load_user, invalidate_user, User
+import config
+
+# Cache des résultats d'analyse par utilisateur.
+# La clé contient la version des données de l'utilisateur (users.data_version) :
+# toute modification d'utilisation ou d'équipement incrémente cette version
+# (bump_data_version) et les anciens résultats ne sont plus jamais servis.
+
+_MISSING = object()
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """Interface d'un stockage de cache (en mémoire, ou partagé entre processus)"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Retourne la valeur associée à key, ou _MISSING"""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'backend': type(self).__name__, 'hits': self.hits, 'misses': self.misses}
+
+
+class MemoryCache(CacheBackend):
+    """Cache propre au processus : taille bornée, éviction LRU et durée de vie (TTL)"""
+
+    def __init__(self, max_entries=1024, ttl=600):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()  # clé -> (expiration, valeur)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        result = super().stats()
+        result.update(entries=len(self._entries), max_entries=self.max_entries, evictions=self.evictions)
+        return result
+
+
+class RedisCache(CacheBackend):
+    """Cache partagé entre les processus (nécessite le paquet redis)
+
+    Une panne de Redis ne bloque pas les pages : l'erreur est journalisée, la lecture
+    compte comme un défaut de cache et le résultat est recalculé sans être enregistré.
+    """
+
+    def __init__(self, url, ttl=600, prefix='ecosense:'):
+        super().__init__()
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.error_class = redis.RedisError
+        self.ttl = ttl
+        self.prefix = prefix
+        self.errors = 0
+
+    def _key(self, key):
+        return self.prefix + repr(key)
+
+    def _error(self, operation, error):
+        self.errors += 1
+        logger.warning('Cache Redis indisponible (%s) : %s', operation, error)
+
+    def get(self, key):
+        try:
+            raw = self.client.get(self._key(key))
+        except self.error_class as error:
+            self._error('lecture', error)
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value):
+        try:
+            self.client.set(self._key(key), pickle.dumps(value), ex=self.ttl)
+        except self.error_class as error:
+            self._error('écriture', error)
+
+    def clear(self):
+        try:
+            for key in self.client.scan_iter(self.prefix + '*'):
+                self.client.delete(key)
+        except self.error_class as error:
+            self._error('vidage', error)
+
+    def stats(self):
+        result = super().stats()
+        result.update(errors=self.errors)
+        return result
+
+
+class NullCache(CacheBackend):
+    """Cache désactivé : tout est recalculé"""
+
+    def get(self, key):
+        self.misses += 1
+        return _MISSING
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+def _create_backend():
+    if config.CACHE_BACKEND == 'redis':
+        return RedisCache(config.CACHE_REDIS_URL, ttl=config.CACHE_TTL)
+    if config.CACHE_BACKEND == 'none':
+        return NullCache()
+    return MemoryCache(max_entries=config.CACHE_MAX_ENTRIES, ttl=config.CACHE_TTL)
+
+
+_backend = None
+
+
+def get_cache():
+    global _backend
+    if _backend is None:
+        _backend = _create_backend()
+    return _backend
+
+
+def set_cache(backend):
+    """Remplace le stockage du cache (ex: cache partagé configuré par l'application)"""
+    global _backend
+    _backend = backend
+
+
+def cache_stats():
+    return get_cache().stats()
+
+
+def get_data_version(user_id):
+    """Version des données de l'utilisateur (lue avec l'utilisateur, une seule fois par requête Flask)"""
+    user = load_user(user_id)
+    return (user.data_version or 0) if user is not None else 0
+
+
+def bump_data_version(db, user_id):
+    """À appeler dans la transaction qui modifie les utilisations ou équipements de l'utilisateur
+
+    Retourne la nouvelle version, celle que le commit de la transaction publiera (la ligne
+    de l'utilisateur reste verrouillée en écriture jusqu'au commit).
+    """
+    db.query(User).filter(User.id == user_id).update(
+        {User.data_version: User.data_version + 1},
+        synchronize_session=False
+    )
+    invalidate_user(user_id)
+    return db.query(User.data_version).filter(User.id == user_id).scalar()
+
+
+def analytics_etag(user_id, *parts):
+    """ETag des données d'analyse de l'utilisateur (mêmes éléments que la clé de cached_analytics)
+
+    Calculé sans rien recalculer : une réponse 304 ne coûte que la lecture de data_version.
+    """
+    raw = repr((user_id, get_data_version(user_id), date.today().isoformat()) + parts)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def cached_analytics(func):
+    """Met en cache le résultat de func(user_id, ...) tant que les données de l'utilisateur ne changent pas
+
+    La date du jour fait partie de la clé : les séries « 7 derniers jours » ou « mois en cours »
+    sont recalculées après minuit même sans nouvelle donnée.
+    """
+    @wraps(func)
+    def wrapper(user_id, *args, **kwargs):
+        cache = get_cache()
+        key = (func.__name__, user_id, args, tuple(sorted(kwargs.items())),
+               get_data_version(user_id), date.today().isoformat())
+
+        value = cache.get(key)
+        if value is _MISSING:
+            value = func(user_id, *args, **kwargs)
+            cache.set(key, value)
+        return value
+
+    return wrapper
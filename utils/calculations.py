@@ -1,319 +1,286 @@
 from datetime import datetime, timedelta
-from models.database import get_session, Usage
-import numpy as np
-from sklearn.linear_model import LinearRegression
+from models.database import db_session
+from utils.cache import cached_analytics
+import config
 
 
-def get_weekly_data(user_id):
-    """Récupère les données de la semaine"""
-    db = get_session()
-    try:
+def aggregations():
+    """Source des totaux : SQL (utils/aggregations.py) ou séries en mémoire (utils/series.py)
+
+    Les deux modules ont la même interface ; utils/series.py (NumPy) n'est importé
+    que si config.ANALYTICS_BACKEND = 'series'.
+    """
+    if config.ANALYTICS_BACKEND == 'series':
+        import utils.series as source
+    else:
+        import utils.aggregations as source
+    return source
+
+
+def _weekly_series(daily_data, today):
+    """Série des 7 derniers jours à partir de {'YYYY-MM-DD': kWh}"""
+    # Compléter les jours manquants avec 0
+    result = []
+    for i in range(7):
+        date = (today - timedelta(days=6 - i)).strftime('%Y-%m-%d')
+        result.append({
+            'date': date,
+            'day_name': (today - timedelta(days=6 - i)).strftime('%a'),
+            'consommation': round(daily_data.get(date, 0), 2)
+        })
+
+    return result
+
+
+def _monthly_series(daily_data):
+    """Totaux par semaine ISO à partir de {'YYYY-MM-DD': kWh}"""
+    weekly_data = {}
+    for day, total in daily_data.items():
+        week_num = datetime.strptime(day, '%Y-%m-%d').isocalendar()[1]
+        weekly_data[week_num] = weekly_data.get(week_num, 0) + total
+
+    result = []
+    for week_num, total in sorted(weekly_data.items()):
+        result.append({
+            'week': f'Semaine {week_num}',
+            'consommation': round(total, 2)
+        })
+
+    return result
+
+
+def _breakdown_series(equipment_data):
+    """Top 10 des équipements à partir de [(nom, kWh)] ou {nom: kWh}"""
+    if isinstance(equipment_data, dict):
+        equipment_data = sorted(equipment_data.items(), key=lambda x: (-x[1], x[0]))
+
+    result = []
+    for name, total in equipment_data[:10]:  # Top 10
+        result.append({
+            'name': name,
+            'consommation': round(total, 2)
+        })
+
+    return result
+
+
+# Nombre de requêtes SQL émises par get_dashboard_snapshot, quel que soit l'historique
+DASHBOARD_SNAPSHOT_QUERIES = 1
+
+
+@cached_analytics
+def get_dashboard_snapshot(user_id):
+    """Toutes les données de la page Statistiques en une seule requête
+
+    Lit le cumul journalier par équipement : un total par équipement pour l'historique
+    ancien, et le détail par jour depuis le plus ancien des débuts de période affichés
+    (7 derniers jours, semaine en cours, mois en cours).
+    """
+    with db_session() as db:
         today = datetime.now()
-        week_ago = today - timedelta(days=7)
-
-        usages = db.query(Usage).filter(
-            Usage.user_id == user_id,
-            Usage.date >= week_ago
-        ).all()
-
-        # Grouper par jour
-        daily_data = {}
-        for usage in usages:
-            day = usage.date.strftime('%Y-%m-%d')
-            if day not in daily_data:
-                daily_data[day] = 0
-            daily_data[day] += usage.consommation_kwh
-
-        # Compléter les jours manquants avec 0
-        result = []
-        for i in range(7):
-            date = (today - timedelta(days=6 - i)).strftime('%Y-%m-%d')
-            result.append({
-                'date': date,
-                'day_name': (today - timedelta(days=6 - i)).strftime('%a'),
-                'consommation': round(daily_data.get(date, 0), 2)
-            })
-
-        return result
-    finally:
-        db.close()
+        week_start = (today - timedelta(days=today.weekday())).date()
+        month_start = today.replace(day=1).date()
+        recent_start = min(month_start, (today - timedelta(days=6)).date())
+
+        total_consommation = 0.0
+        total_usages = 0
+        week_total = 0.0
+        month_total = 0.0
+        daily_data = {}        # jours depuis recent_start
+        equipment_all = {}     # tout l'historique
+        equipment_month = {}   # mois en cours
+
+        for name, day, kwh, count in aggregations().dashboard_rows(db, user_id, recent_start):
+            total_consommation += kwh
+            total_usages += count
+            if name is not None:
+                equipment_all[name] = equipment_all.get(name, 0) + kwh
+            if day is None:
+                continue
+
+            daily_data[day] = daily_data.get(day, 0) + kwh
+            if day >= week_start.isoformat():
+                week_total += kwh
+            if day >= month_start.isoformat():
+                month_total += kwh
+                if name is not None:
+                    equipment_month[name] = equipment_month.get(name, 0) + kwh
+
+        month_daily_data = {day: kwh for day, kwh in daily_data.items() if day >= month_start.isoformat()}
+
+        return {
+            'total_usages': total_usages,
+            'total_consommation': round(total_consommation, 2),
+            'week_total': round(week_total, 2),
+            'month_total': round(month_total, 2),
+            'weekly_data': _weekly_series(daily_data, today),
+            'monthly_data': _monthly_series(month_daily_data),
+            'equipment_data': _breakdown_series(equipment_all),
+            'equipment_data_month': _breakdown_series(equipment_month),
+        }
+
+
+# Compatibilité : anciennes fonctions de la page Statistiques, que l'application n'appelle
+# plus (les pages et l'API lisent get_dashboard_snapshot)
+def get_weekly_data(user_id):
+    """Données des 7 derniers jours (via le cache de get_dashboard_snapshot)"""
+    return get_dashboard_snapshot(user_id)['weekly_data']
 
 
 def get_monthly_data(user_id):
-    """Récupère les données du mois"""
-    db = get_session()
-    try:
-        today = datetime.now()
-        month_start = today.replace(day=1)
-
-        usages = db.query(Usage).filter(
-            Usage.user_id == user_id,
-            Usage.date >= month_start
-        ).all()
-
-        # Grouper par semaine
-        weekly_data = {}
-        for usage in usages:
-            week_num = usage.date.isocalendar()[1]
-            if week_num not in weekly_data:
-                weekly_data[week_num] = 0
-            weekly_data[week_num] += usage.consommation_kwh
-
-        result = []
-        for week_num, total in sorted(weekly_data.items()):
-            result.append({
-                'week': f'Semaine {week_num}',
-                'consommation': round(total, 2)
-            })
-
-        return result
-    finally:
-        db.close()
-
-
-def get_equipment_breakdown(user_id):
-    """Répartition par équipement"""
-    db = get_session()
-    try:
-        usages = db.query(Usage).filter(Usage.user_id == user_id).all()
-
-        equipment_data = {}
-        for usage in usages:
-            name = usage.equipment.name
-            if name not in equipment_data:
-                equipment_data[name] = 0
-            equipment_data[name] += usage.consommation_kwh
-
-        # Trier par consommation décroissante
-        sorted_data = sorted(equipment_data.items(), key=lambda x: x[1], reverse=True)
-
-        result = []
-        for name, total in sorted_data[:10]:  # Top 10
-            result.append({
-                'name': name,
-                'consommation': round(total, 2)
-            })
-
-        return result
-    finally:
-        db.close()
+    """Données du mois par semaine (via le cache de get_dashboard_snapshot)"""
+    return get_dashboard_snapshot(user_id)['monthly_data']
+
+
+def get_equipment_breakdown(user_id, start=None, end=None):
+    """Répartition par équipement, sur tout l'historique ou sur [start, end["""
+    if start is None and end is None:
+        return get_dashboard_snapshot(user_id)['equipment_data']
+    return _equipment_breakdown(user_id, start, end)
+
+
+@cached_analytics
+def _equipment_breakdown(user_id, start, end):
+    with db_session() as db:
+        return _breakdown_series(aggregations().equipment_totals(db, user_id, start, end, limit=10))
+
+
+def get_stored_predictions(user_id):
+    """Prévisions des 7 prochains jours enregistrées par le traitement de nuit (utils/batch_forecast.py)
+
+    Retourne None si le traitement n'a pas encore couvert ces 7 jours pour l'utilisateur.
+    """
+    from models.database import Prediction
+
+    with db_session() as db:
+        tomorrow = datetime.combine(datetime.now().date(), datetime.min.time()) + timedelta(days=1)
+        rows = db.query(Prediction.date, Prediction.consommation_prevue).filter(
+            Prediction.user_id == user_id,
+            Prediction.date >= tomorrow,
+            Prediction.date < tomorrow + timedelta(days=7)
+        ).order_by(Prediction.date).all()
+
+    if len(rows) < 7:
+        return None
+
+    return [{
+        'date': date.strftime('%Y-%m-%d'),
+        'day_name': date.strftime('%a'),
+        'prediction': round(value, 2)
+    } for date, value in rows]
 
 
 def predict_next_week(user_id):
-    """Prédiction pour la semaine prochaine avec régression linéaire"""
-    db = get_session()
-    try:
-        # Récupérer les 30 derniers jours
-        today = datetime.now()
-        month_ago = today - timedelta(days=30)
-
-        usages = db.query(Usage).filter(
-            Usage.user_id == user_id,
-            Usage.date >= month_ago
-        ).all()
-
-        if len(usages) < 7:
-            return None  # Pas assez de données
-
-        # Grouper par jour
-        daily_data = {}
-        for usage in usages:
-            day = usage.date.strftime('%Y-%m-%d')
-            if day not in daily_data:
-                daily_data[day] = 0
-            daily_data[day] += usage.consommation_kwh
-
-        # Préparer les données pour la régression
-        dates = sorted(daily_data.keys())
-        X = np.array(range(len(dates))).reshape(-1, 1)
-        y = np.array([daily_data[date] for date in dates])
-
-        # Créer et entraîner le modèle
-        model = LinearRegression()
-        model.fit(X, y)
-
-        # Prédire les 7 prochains jours
-        future_X = np.array(range(len(dates), len(dates) + 7)).reshape(-1, 1)
-        predictions = model.predict(future_X)
-
-        result = []
-        for i, pred in enumerate(predictions):
-            future_date = today + timedelta(days=i + 1)
-            result.append({
-                'date': future_date.strftime('%Y-%m-%d'),
-                'day_name': future_date.strftime('%a'),
-                'prediction': round(max(0, pred), 2)
-            })
-
-        return result
-    finally:
-        db.close()
-
-
-def check_daily_consumption_alert(user_id):
-    """Vérifie si la consommation du jour dépasse le seuil"""
-    from models.database import User, Alert
-
-    db = get_session()
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
-
-        # Consommation du jour
-        today = datetime.now().date()
-        today_start = datetime.combine(today, datetime.min.time())
-        today_end = datetime.combine(today, datetime.max.time())
-
-        usages = db.query(Usage).filter(
-            Usage.user_id == user_id,
-            Usage.date >= today_start,
-            Usage.date <= today_end
-        ).all()
-
-        daily_total = sum(u.consommation_kwh for u in usages)
-
-        # Vérifier si dépasse le seuil
-        if daily_total > user.alert_threshold:
-            # Vérifier si une alerte similaire existe déjà aujourd'hui
-            existing_alert = db.query(Alert).filter(
-                Alert.user_id == user_id,
-                Alert.alert_type == 'warning',
-                Alert.date_created >= today_start
-            ).first()
-
-            if not existing_alert:
-                alert = Alert(
-                    user_id=user_id,
-                    message=f"⚠️ Surconsommation détectée : {round(daily_total, 2)} kWh aujourd'hui (seuil : {user.alert_threshold} kWh)",
-                    alert_type='warning'
-                )
-                db.add(alert)
-                db.commit()
-                return True
-
-        return False
-    finally:
-        db.close()
+    """Prédiction pour la semaine prochaine (voir utils/predictions.py)
+
+    Importé à la demande : NumPy n'est chargé que sur le chemin des prédictions.
+    """
+    from utils.predictions import predict_next_week as predict
+
+    return predict(user_id)
 
 
 def get_user_alerts(user_id):
     """Récupère les alertes non lues de l'utilisateur"""
     from models.database import Alert
 
-    db = get_session()
-    try:
+    with db_session() as db:
         alerts = db.query(Alert).filter(
             Alert.user_id == user_id,
             Alert.is_read == 0
         ).order_by(Alert.date_created.desc()).limit(5).all()
 
         return alerts
-    finally:
-        db.close()
 
 
 def mark_alert_as_read(alert_id):
     """Marquer une alerte comme lue"""
     from models.database import Alert
 
-    db = get_session()
-    try:
+    with db_session() as db:
         alert = db.query(Alert).filter(Alert.id == alert_id).first()
         if alert:
             alert.is_read = 1
             db.commit()
-    finally:
-        db.close()
 
 
-def get_monthly_comparison(user_id, months=6):
-    """Comparaison des N derniers mois"""
-    db = get_session()
-    try:
-        today = datetime.now()
-        result = []
+# Fenêtres proposées sur la page Comparaisons (en mois)
+COMPARISON_MONTHS = (6, 12, 24, 36)
 
-        for i in range(months):
-            # Calculer le mois
-            month_date = today - timedelta(days=30 * i)
-            month_start = month_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+# Nombre de requêtes SQL émises par get_comparisons, quel que soit le nombre de mois
+COMPARISONS_QUERIES = 1
 
-            # Calculer le dernier jour du mois
-            if month_start.month == 12:
-                month_end = month_start.replace(year=month_start.year + 1, month=1, day=1) - timedelta(seconds=1)
-            else:
-                month_end = month_start.replace(month=month_start.month + 1, day=1) - timedelta(seconds=1)
 
-            # Récupérer les usages du mois
-            usages = db.query(Usage).filter(
-                Usage.user_id == user_id,
-                Usage.date >= month_start,
-                Usage.date <= month_end
-            ).all()
+def _month_starts(today, months):
+    """Premiers jours des N derniers mois calendaires, du plus ancien au plus récent"""
+    year, month = today.year, today.month
+    starts = []
+    for _ in range(months):
+        starts.append(datetime(year, month, 1))
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return list(reversed(starts))
 
-            total = sum(u.consommation_kwh for u in usages)
 
-            result.append({
-                'month': month_start.strftime('%B %Y'),
-                'month_short': month_start.strftime('%b %Y'),
-                'consommation': round(total, 2),
-                'cout': round(total * 150, 0)
-            })
+def _comparison_rows(buckets, month_starts):
+    """Une ligne par mois à partir des totaux {'YYYY-MM': kWh}"""
+    result = []
+    for month_start in month_starts:
+        total = buckets.get(month_start.strftime('%Y-%m'), 0)
+        result.append({
+            'month': month_start.strftime('%B %Y'),
+            'month_short': month_start.strftime('%b %Y'),
+            'consommation': round(total, 2),
+            'cout': round(total * 150, 0)
+        })
+    return result
 
-        # Inverser pour avoir du plus ancien au plus récent
-        return list(reversed(result))
-    finally:
-        db.close()
 
+def _comparison_stats(buckets, month_starts):
+    """Mois actuel, mois précédent, évolution et moyenne sur les mois de month_starts"""
+    current_month_total = buckets.get(month_starts[-1].strftime('%Y-%m'), 0)
+    last_month_total = buckets.get(month_starts[-2].strftime('%Y-%m'), 0)
 
-def get_comparison_stats(user_id):
-    """Statistiques de comparaison"""
-    db = get_session()
-    try:
-        today = datetime.now()
+    # Calculer la différence
+    if last_month_total > 0:
+        difference = ((current_month_total - last_month_total) / last_month_total) * 100
+    else:
+        difference = 0
 
-        # Mois actuel
-        current_month_start = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        current_month_usages = db.query(Usage).filter(
-            Usage.user_id == user_id,
-            Usage.date >= current_month_start
-        ).all()
-        current_month_total = sum(u.consommation_kwh for u in current_month_usages)
-
-        # Mois précédent
-        if current_month_start.month == 1:
-            last_month_start = current_month_start.replace(year=current_month_start.year - 1, month=12)
-        else:
-            last_month_start = current_month_start.replace(month=current_month_start.month - 1)
-
-        last_month_usages = db.query(Usage).filter(
-            Usage.user_id == user_id,
-            Usage.date >= last_month_start,
-            Usage.date < current_month_start
-        ).all()
-        last_month_total = sum(u.consommation_kwh for u in last_month_usages)
-
-        # Calculer la différence
-        if last_month_total > 0:
-            difference = ((current_month_total - last_month_total) / last_month_total) * 100
-        else:
-            difference = 0
-
-        # Moyenne mensuelle (6 derniers mois)
-        six_months_ago = today - timedelta(days=180)
-        all_usages = db.query(Usage).filter(
-            Usage.user_id == user_id,
-            Usage.date >= six_months_ago
-        ).all()
-
-        total_consumption = sum(u.consommation_kwh for u in all_usages)
-        average_monthly = total_consumption / 6 if all_usages else 0
+    # Moyenne mensuelle (mois calendaires affichés, mois en cours inclus)
+    period_total = sum(buckets.get(m.strftime('%Y-%m'), 0) for m in month_starts)
+    average_monthly = period_total / len(month_starts)
 
-        return {
-            'current_month': round(current_month_total, 2),
-            'last_month': round(last_month_total, 2),
-            'difference': round(difference, 1),
-            'average_monthly': round(average_monthly, 2),
-            'trend': 'up' if difference > 0 else 'down' if difference < 0 else 'stable'
-        }
-    finally:
-        db.close()
\ No newline at end of file
+    return {
+        'current_month': round(current_month_total, 2),
+        'last_month': round(last_month_total, 2),
+        'difference': round(difference, 1),
+        'average_monthly': round(average_monthly, 2),
+        'trend': 'up' if difference > 0 else 'down' if difference < 0 else 'stable'
+    }
+
+
+@cached_analytics
+def get_comparisons(user_id, months=6):
+    """Comparaison des N derniers mois et statistiques, à partir d'une seule requête
+
+    Retourne (monthly_data, stats) : les totaux sont regroupés par mois calendaire
+    par SQLite sur toute la fenêtre ; la moyenne mensuelle porte sur les N mois (au moins 6).
+    """
+    with db_session() as db:
+        month_starts = _month_starts(datetime.now(), max(months, 6))
+        buckets = aggregations().monthly_totals(db, user_id, start=month_starts[0])
+
+        return (_comparison_rows(buckets, month_starts[-months:]),
+                _comparison_stats(buckets, month_starts))
+
+
+def get_monthly_comparison(user_id, months=6):
+    """Comparaison des N derniers mois, du plus ancien au plus récent (via le cache de get_comparisons)"""
+    return get_comparisons(user_id, months)[0]
+
+
+def get_comparison_stats(user_id):
+    """Statistiques de comparaison (via le cache de get_comparisons)"""
+    return get_comparisons(user_id)[1]
@@ -0,0 +1,98 @@
+import csv
+import heapq
+import io
+import json
+from sqlalchemy import and_, or_
+from models.database import db_session, Usage
+from utils.history import usage_rows_query, archived_months_query
+
+# Export de l'historique d'utilisations d'un utilisateur (CSV ou JSON).
+# Les lignes sont lues par paquets en pagination par clé (date, id) et envoyées
+# au fil de l'eau : la mémoire utilisée ne dépend pas de la taille de l'historique.
+# Les colonnes reprennent celles de l'import (utils/importer.py), plus le nom de l'équipement.
+# Les utilisations archivées (utils/archive.py) sont fusionnées dans l'ordre (date, id).
+
+CHUNK_SIZE = 1000
+FLUSH_SIZE = 64 * 1024  # taille (en caractères) des morceaux envoyés au client
+COLUMNS = ('id', 'equipment_id', 'equipment', 'date', 'duree_heures', 'consommation_kwh')
+
+
+def iter_usage_rows(db, user_id, start=None, end=None, equipment_id=None, chunk_size=CHUNK_SIZE):
+    """Utilisations (tuples, ordre de COLUMNS) par date croissante, table et archives confondues"""
+    rows = iter_hot_usage_rows(db, user_id, start, end, equipment_id, chunk_size)
+    months = archived_months_query(db, user_id, start, end).all()
+    if not months:
+        return rows
+
+    from utils.archive import iter_archived_usages
+
+    archived = (row[:6] for row in iter_archived_usages(db, user_id, start, end, equipment_id, months))
+    return heapq.merge(archived, rows, key=lambda row: (row[3], row[0]))
+
+
+def iter_hot_usage_rows(db, user_id, start=None, end=None, equipment_id=None, chunk_size=CHUNK_SIZE):
+    """Utilisations de la table usages par date croissante, une requête par paquet
+
+    start inclus, end exclu. Chaque paquet reprend après la dernière clé (date, id) lue,
+    ce qui suit l'index ix_usages_user_id_date sans OFFSET.
+    """
+    query = usage_rows_query(db, user_id, start, end, equipment_id).order_by(Usage.date, Usage.id)
+
+    last = None
+    while True:
+        chunk_query = query
+        if last is not None:
+            chunk_query = chunk_query.filter(or_(
+                Usage.date > last[3],
+                and_(Usage.date == last[3], Usage.id > last[0])
+            ))
+        rows = chunk_query.limit(chunk_size).all()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+
+
+def _format_row(row):
+    usage_id, equipment_id, name, usage_date, duree_heures, consommation = row
+    return (usage_id, equipment_id, name, usage_date.strftime('%Y-%m-%d %H:%M:%S'),
+            duree_heures, round(consommation, 4))
+
+
+def generate_csv(rows):
+    """Fichier CSV (séparateur ; comme l'import), envoyé par morceaux d'environ FLUSH_SIZE caractères"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow(_format_row(row))
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def generate_json(rows):
+    """Tableau JSON, envoyé par morceaux d'environ FLUSH_SIZE caractères"""
+    parts = ['[']
+    size = 1
+    separator = '\n'
+    for row in rows:
+        part = separator + json.dumps(dict(zip(COLUMNS, _format_row(row))), ensure_ascii=False)
+        parts.append(part)
+        size += len(part)
+        separator = ',\n'
+        if size >= FLUSH_SIZE:
+            yield ''.join(parts)
+            parts = []
+            size = 0
+    parts.append('\n]\n')
+    yield ''.join(parts)
+
+
+def export_usages(user_id, file_format='csv', **filters):
+    """Générateur du fichier d'export ; la session n'est ouverte que pendant la lecture"""
+    generate = generate_json if file_format == 'json' else generate_csv
+    with db_session() as db:
+        yield from generate(iter_usage_rows(db, user_id, **filters))
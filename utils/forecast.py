@@ -0,0 +1,104 @@
+from datetime import datetime
+import numpy as np
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import OperationalError
+from models.database import get_session, PredictionModel
+import config
+
+# Tendance linéaire de la consommation journalière : y = intercept + slope * x,
+# où x est l'indice du jour (0 = plus ancien jour avec des données).
+
+
+def fit_linear_trend(y):
+    """Moindres carrés en forme close (NumPy) : retourne (slope, intercept)
+
+    Même calcul que sklearn.linear_model.LinearRegression sur X = 0..n-1 (données centrées),
+    sans importer scikit-learn.
+    """
+    y = np.asarray(y, dtype=float)
+    x = np.arange(len(y), dtype=float)
+    x_mean = x.mean()
+    y_mean = y.mean()
+    denominator = ((x - x_mean) ** 2).sum()
+    slope = ((x - x_mean) * (y - y_mean)).sum() / denominator if denominator else 0.0
+    return float(slope), float(y_mean - slope * x_mean)
+
+
+def fit_linear_trends(values, present):
+    """Version vectorisée de fit_linear_trend pour une matrice utilisateurs × jours
+
+    values : kWh par jour (0 les jours sans données), present : jours avec des données.
+    Comme pour un seul utilisateur, x est le rang du jour parmi les jours avec des données.
+    Retourne (slopes, intercepts, n_points), un élément par ligne.
+    """
+    present = np.asarray(present, dtype=bool)
+    values = np.where(present, values, 0.0)
+    x = np.where(present, np.cumsum(present, axis=1) - 1, 0).astype(float)
+    n_points = present.sum(axis=1)
+    safe_n = np.maximum(n_points, 1)
+
+    x_mean = x.sum(axis=1) / safe_n
+    y_mean = values.sum(axis=1) / safe_n
+    dx = np.where(present, x - x_mean[:, None], 0.0)
+    dy = np.where(present, values - y_mean[:, None], 0.0)
+    numerator = (dx * dy).sum(axis=1)
+    denominator = (dx ** 2).sum(axis=1)
+    slopes = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+    return slopes, y_mean - slopes * x_mean, n_points
+
+
+def fit_linear_trend_sklearn(y):
+    """Même ajustement avec scikit-learn (config.PREDICTION_BACKEND = 'sklearn')"""
+    from sklearn.linear_model import LinearRegression
+
+    X = np.arange(len(y)).reshape(-1, 1)
+    model = LinearRegression()
+    model.fit(X, np.asarray(y, dtype=float))
+    return float(model.coef_[0]), float(model.intercept_)
+
+
+def fit_trend(y):
+    if config.PREDICTION_BACKEND == 'sklearn':
+        return fit_linear_trend_sklearn(y)
+    return fit_linear_trend(y)
+
+
+def forecast(slope, intercept, n_points, days=7):
+    """Valeurs prévues pour les `days` jours qui suivent les n_points jours observés"""
+    future_x = np.arange(n_points, n_points + days, dtype=float)
+    return intercept + slope * future_x
+
+
+def load_model(db, user_id, data_version, day):
+    """Paramètres enregistrés s'ils correspondent à la version des données et au jour, sinon None"""
+    model = db.query(PredictionModel).filter(PredictionModel.user_id == user_id).first()
+    if model is None or model.data_version != data_version or model.fitted_on != day:
+        return None
+    return model
+
+
+def save_model(user_id, data_version, day, usage_count, slope, intercept, n_points):
+    """Enregistre (ou remplace) les paramètres ajustés pour l'utilisateur
+
+    Dans une session dédiée, validée aussitôt : la session de la requête (lecture, GET)
+    n'est jamais validée par ce chemin. Les paramètres ne sont qu'un cache : si la base
+    est verrouillée, ils ne sont pas enregistrés et seront réajustés à la prochaine lecture.
+    """
+    values = {
+        'data_version': data_version,
+        'fitted_on': day,
+        'usage_count': usage_count,
+        'slope': slope,
+        'intercept': intercept,
+        'n_points': n_points,
+        'date_created': datetime.now(),
+    }
+    stmt = insert(PredictionModel).values(user_id=user_id, **values)
+    db = get_session()
+    try:
+        db.execute(stmt.on_conflict_do_update(index_elements=['user_id'], set_=values))
+        db.commit()
+    except OperationalError:
+        db.rollback()
+    finally:
+        db.close()
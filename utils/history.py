@@ -0,0 +1,85 @@
+from datetime import datetime
+from sqlalchemy import and_, or_
+from models.database import ArchivedMonth, Equipment, Usage
+
+# Historique des utilisations d'un utilisateur, en pagination par clé (keyset) sur (date, id) :
+# la page suivante reprend après la dernière ligne affichée, via l'index
+# ix_usages_user_id_date (qui contient aussi l'id). Aucune page ne fait d'OFFSET :
+# la page N coûte autant que la page 1.
+# Les mois archivés (utils/archive.py) sont lus dans leurs fichiers et fusionnés par (date, id).
+
+PER_PAGE = 50
+MAX_PER_PAGE = 500
+CURSOR_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def usage_rows_query(db, user_id, start=None, end=None, equipment_id=None):
+    """Utilisations de l'utilisateur avec le nom de l'équipement (colonnes seules, une requête)
+
+    start inclus, end exclu.
+    """
+    query = db.query(
+        Usage.id,
+        Usage.equipment_id,
+        Equipment.name.label('equipment'),
+        Usage.date,
+        Usage.duree_heures,
+        Usage.consommation_kwh
+    ).join(Equipment, Equipment.id == Usage.equipment_id).filter(Usage.user_id == user_id)
+    if start is not None:
+        query = query.filter(Usage.date >= start)
+    if end is not None:
+        query = query.filter(Usage.date < end)
+    if equipment_id is not None:
+        query = query.filter(Usage.equipment_id == equipment_id)
+    return query
+
+
+def archived_months_query(db, user_id, start=None, end=None):
+    """Résumés des mois archivés de l'utilisateur qui recoupent [start, end[ (sans charger NumPy)"""
+    query = db.query(ArchivedMonth).filter(ArchivedMonth.user_id == user_id)
+    if start is not None:
+        start = start.date() if isinstance(start, datetime) else start
+        query = query.filter(ArchivedMonth.month >= start.replace(day=1))
+    if end is not None:
+        query = query.filter(ArchivedMonth.month < end)
+    return query.order_by(ArchivedMonth.month)
+
+
+def encode_cursor(row):
+    return f"{row.date.strftime(CURSOR_FORMAT)}_{row.id}"
+
+
+def decode_cursor(cursor):
+    """(date, id) de la dernière ligne de la page précédente ; ValueError si le curseur est invalide"""
+    date_part, _, id_part = cursor.rpartition('_')
+    return datetime.strptime(date_part, CURSOR_FORMAT), int(id_part)
+
+
+def history_page(db, user_id, cursor=None, per_page=PER_PAGE, **filters):
+    """Une page de l'historique, de la plus récente à la plus ancienne
+
+    Retourne (lignes, curseur de la page suivante ou None).
+    """
+    query = usage_rows_query(db, user_id, **filters)
+    last = None
+    if cursor is not None:
+        last = decode_cursor(cursor)
+        query = query.filter(or_(
+            Usage.date < last[0],
+            and_(Usage.date == last[0], Usage.id < last[1])
+        ))
+
+    # Une ligne de plus que demandé : indique s'il reste une page
+    rows = query.order_by(Usage.date.desc(), Usage.id.desc()).limit(per_page + 1).all()
+
+    months = archived_months_query(db, user_id, filters.get('start'), filters.get('end')).all()
+    if months:
+        from utils.archive import archived_page_before
+
+        rows += archived_page_before(db, user_id, months, last, per_page + 1, **filters)
+        rows = sorted(rows, key=lambda row: (row.date, row.id), reverse=True)[:per_page + 1]
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
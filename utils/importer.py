@@ -0,0 +1,271 @@
+import argparse
+import csv
+import io
+import json
+from datetime import datetime
+from models.database import db_session, Equipment, Usage, User
+from utils.cache import bump_data_version
+from utils.alerts import evaluate_alerts
+from utils.rollup import record_usages_added
+
+# Import en masse d'utilisations (historiques de compteur) depuis un fichier CSV ou JSON.
+# Le fichier est lu en flux (jamais entièrement en mémoire) et inséré par paquets :
+# une transaction par paquet, cumuls journaliers compris, puis les alertes des jours touchés
+# sont évaluées en une fois.
+#
+# Colonnes / clés attendues : equipment_id, date, duree_heures, consommation_kwh (optionnelle :
+# calculée à partir de la puissance de l'équipement si absente ou vide).
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 20
+DATE_FORMATS = ('%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+
+class InvalidRow(ValueError):
+    """Ligne invalide (le message est affiché à l'utilisateur)"""
+
+
+def iter_csv_rows(stream):
+    """(numéro de ligne du fichier, dictionnaire) des lignes d'un fichier CSV (séparateur , ou ;)"""
+    first_line = stream.readline()
+    delimiter = ';' if first_line.count(';') > first_line.count(',') else ','
+    header = next(csv.reader([first_line], delimiter=delimiter))
+    reader = csv.DictReader(stream, fieldnames=[name.strip() for name in header], delimiter=delimiter)
+    # line_num compte les lignes lues après l'en-tête ; un enregistrement peut en occuper plusieurs
+    start = 2
+    for row in reader:
+        yield start, row
+        start = reader.line_num + 2
+
+
+def iter_json_rows(stream, chunk_size=65536):
+    """(numéro de ligne, élément) d'un tableau JSON ou d'un fichier JSON Lines, décodés au fil de la lecture
+
+    Un tableau est lu élément par élément (un élément peut lui-même être un tableau) ;
+    ValueError si le fichier est tronqué ou mal formé.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    line_number = 1
+    eof = False
+
+    def read_more():
+        nonlocal buffer, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+    def next_char():
+        """Premier caractère après les espaces ('' en fin de fichier), sans le consommer"""
+        nonlocal buffer, line_number
+        while True:
+            stripped = buffer.lstrip(' \t\r\n')
+            line_number += buffer[:len(buffer) - len(stripped)].count('\n')
+            buffer = stripped
+            if buffer or eof:
+                return buffer[:1]
+            read_more()
+
+    def consume(count):
+        nonlocal buffer, line_number
+        line_number += buffer[:count].count('\n')
+        buffer = buffer[count:]
+
+    def decode():
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                read_more()
+                continue
+            # Un nombre en fin de tampon peut continuer dans le paquet suivant
+            if end == len(buffer) and not eof:
+                read_more()
+                continue
+            return obj, end
+
+    if next_char() != '[':
+        # JSON Lines (ou objets simplement concaténés)
+        while next_char():
+            first_line = line_number
+            obj, end = decode()
+            yield first_line, obj
+            consume(end)
+        return
+
+    consume(1)
+    if next_char() == ']':
+        consume(1)
+    else:
+        while True:
+            if not next_char():
+                raise ValueError("tableau JSON incomplet")
+            first_line = line_number
+            obj, end = decode()
+            yield first_line, obj
+            consume(end)
+            char = next_char()
+            if char == ',':
+                consume(1)
+            elif char == ']':
+                consume(1)
+                break
+            elif not char:
+                raise ValueError("tableau JSON incomplet")
+            else:
+                raise ValueError(f"',' ou ']' attendu, reçu {char!r}")
+    if next_char():
+        raise ValueError("données après la fin du tableau JSON")
+
+
+def _parse_date(value):
+    value = (value or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise InvalidRow(f"date invalide : {value!r}")
+
+
+def _parse_float(row, key, required=True):
+    value = row.get(key)
+    if value is None or str(value).strip() == '':
+        if required:
+            raise InvalidRow(f"{key} manquant")
+        return None
+    try:
+        number = float(str(value).replace(',', '.'))
+    except ValueError:
+        raise InvalidRow(f"{key} invalide : {value!r}")
+    if number < 0:
+        raise InvalidRow(f"{key} négatif")
+    return number
+
+
+def import_usages(db, user_id, rows, chunk_size=CHUNK_SIZE):
+    """Importe les utilisations de `rows` (itérable de (numéro de ligne, dictionnaire)) pour l'utilisateur
+
+    Retourne un rapport : nombre de lignes importées, erreurs (numéro de ligne, message),
+    nombre d'alertes créées et, si la lecture du fichier a échoué en route, la ligne où elle
+    s'est arrêtée (unreadable_from) : les paquets validés avant restent importés.
+    """
+    equipments = {}  # id -> puissance (W), ou None si l'équipement n'appartient pas à l'utilisateur
+    affected_days = set()
+    pending = []
+    imported = 0
+    errors = []
+    error_count = 0
+    unreadable_from = None
+
+    def flush():
+        nonlocal imported
+        if not pending:
+            return
+        db.bulk_insert_mappings(Usage, pending)
+        days = record_usages_added(db, pending)
+        bump_data_version(db, user_id)
+        db.commit()
+        affected_days.update(days)
+        imported += len(pending)
+        pending.clear()
+
+    def report_error(line_number, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append((line_number, message))
+
+    line_number = 0
+    rows = iter(rows)
+    try:
+        while True:
+            try:
+                line_number, row = next(rows)
+            except StopIteration:
+                break
+            except (ValueError, csv.Error):
+                # Fichier illisible (JSON mal formé, CSV corrompu, encodage) : arrêt de la lecture
+                unreadable_from = line_number + 1
+                break
+
+            try:
+                if not isinstance(row, dict):
+                    raise InvalidRow(f"objet attendu, reçu : {json.dumps(row)[:50]}")
+                try:
+                    equipment_id = int(str(row.get('equipment_id', '')).strip())
+                except ValueError:
+                    raise InvalidRow(f"equipment_id invalide : {row.get('equipment_id')!r}")
+
+                # Propriété de l'équipement vérifiée une seule fois par équipement
+                if equipment_id not in equipments:
+                    equipments[equipment_id] = db.query(Equipment.puissance_watts).filter(
+                        Equipment.id == equipment_id,
+                        Equipment.user_id == user_id
+                    ).scalar()
+                if equipments[equipment_id] is None:
+                    raise InvalidRow(f"équipement {equipment_id} introuvable")
+
+                duree_heures = _parse_float(row, 'duree_heures')
+                consommation = _parse_float(row, 'consommation_kwh', required=False)
+                if not consommation:
+                    consommation = (equipments[equipment_id] * duree_heures) / 1000
+                usage_date = _parse_date(row.get('date'))
+            except InvalidRow as error:
+                report_error(line_number, str(error))
+                continue
+
+            pending.append({
+                'user_id': user_id,
+                'equipment_id': equipment_id,
+                'date': usage_date,
+                'duree_heures': duree_heures,
+                'consommation_kwh': consommation,
+            })
+            if len(pending) >= chunk_size:
+                flush()
+
+        flush()
+    finally:
+        # Paquet non validé (erreur en cours d'insertion) abandonné ; les alertes des jours
+        # des paquets validés sont évaluées quoi qu'il arrive, en une évaluation groupée
+        db.rollback()
+        alerts = evaluate_alerts(db, affected_days, [user_id])
+
+    return {'imported': imported, 'errors': errors, 'error_count': error_count, 'alerts': alerts,
+            'unreadable_from': unreadable_from}
+
+
+def iter_rows(stream, file_format):
+    """(numéro de ligne, ligne) du fichier selon son format ('csv' ou 'json')"""
+    if file_format == 'json':
+        return iter_json_rows(stream)
+    return iter_csv_rows(stream)
+
+
+def detect_format(filename):
+    return 'json' if filename.lower().endswith(('.json', '.jsonl', '.ndjson')) else 'csv'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import en masse d'utilisations (CSV ou JSON)")
+    parser.add_argument('username', help="utilisateur propriétaire des utilisations")
+    parser.add_argument('file', help="fichier CSV, JSON ou JSON Lines")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    with db_session() as db:
+        user_id = db.query(User.id).filter(User.username == args.username).scalar()
+        if user_id is None:
+            parser.error(f"utilisateur introuvable : {args.username}")
+        with io.open(args.file, encoding='utf-8-sig', newline='') as stream:
+            report = import_usages(db, user_id, iter_rows(stream, detect_format(args.file)), args.chunk_size)
+
+    print(f"{report['imported']} utilisations importées, {report['error_count']} lignes ignorées, "
+          f"{report['alerts']} alertes créées")
+    if report['unreadable_from'] is not None:
+        print(f"Lecture arrêtée : fichier illisible à partir de la ligne {report['unreadable_from']}")
+    for line_number, message in report['errors']:
+        print(f"  ligne {line_number} : {message}")
@@ -0,0 +1,225 @@
+import bisect
+import threading
+import time
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from models.database import rows_fetched
+import config
+
+# Mesures de performance par requête HTTP.
+# Pour chaque requête : endpoint, durée, nombre d'instructions SQL, temps passé en base
+# et lignes lues (curseur SQLite de models/database.py). Les agrégats restent en mémoire
+# du processus, bornés : un histogramme à seuils fixes par endpoint (p50/p95/p99 estimés
+# à partir des seuils) et des compteurs. Exposés au format texte Prometheus par
+# /admin/metrics ; les requêtes lentes sont journalisées avec leurs instructions SQL.
+
+# Seuils des histogrammes de durée, en secondes
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+# Instructions SQL gardées par requête pour le journal des requêtes lentes
+MAX_STATEMENTS = 100
+SLOW_LOG_STATEMENTS = 5
+
+
+class Histogram:
+    """Histogramme cumulable à seuils fixes (mémoire constante)"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # dernière case : au-delà du dernier seuil
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimation par interpolation linéaire dans la case (comme histogram_quantile)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class EndpointStats:
+    def __init__(self):
+        self.duration = Histogram()
+        self.statuses = {}
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+
+class Metrics:
+    """Agrégats du processus, par endpoint (ensemble fini : les routes de l'application)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, status, seconds, statements, db_seconds, rows):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.duration.observe(seconds)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.statements += statements
+            stats.db_seconds += db_seconds
+            stats.rows += rows
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def render(self):
+        """Texte au format d'exposition Prometheus (version 0.0.4)"""
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = [
+                '# HELP ecosense_requests_total Requêtes HTTP traitées.',
+                '# TYPE ecosense_requests_total counter',
+            ]
+            for endpoint, stats in endpoints:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'ecosense_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+            lines += [
+                '# HELP ecosense_request_duration_seconds Durée des requêtes HTTP.',
+                '# TYPE ecosense_request_duration_seconds histogram',
+            ]
+            for endpoint, stats in endpoints:
+                cumulative = 0
+                for bound, count in zip(stats.duration.buckets + (float('inf'),), stats.duration.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'ecosense_request_duration_seconds_bucket'
+                                 f'{{endpoint="{endpoint}",le="{le}"}} {cumulative}')
+                lines.append(f'ecosense_request_duration_seconds_sum{{endpoint="{endpoint}"}} {stats.duration.sum}')
+                lines.append(f'ecosense_request_duration_seconds_count{{endpoint="{endpoint}"}} {stats.duration.count}')
+
+            lines += [
+                '# HELP ecosense_request_duration_quantile_seconds Quantiles estimés à partir de l\'histogramme.',
+                '# TYPE ecosense_request_duration_quantile_seconds gauge',
+            ]
+            for endpoint, stats in endpoints:
+                for q in QUANTILES:
+                    lines.append(f'ecosense_request_duration_quantile_seconds'
+                                 f'{{endpoint="{endpoint}",quantile="{q}"}} {stats.duration.quantile(q)}')
+
+            for name, help_text, attribute in (
+                ('ecosense_sql_statements_total', 'Instructions SQL exécutées.', 'statements'),
+                ('ecosense_db_seconds_total', 'Temps passé dans les instructions SQL.', 'db_seconds'),
+                ('ecosense_rows_fetched_total', 'Lignes lues depuis la base.', 'rows'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for endpoint, stats in endpoints:
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {getattr(stats, attribute)}')
+
+        from utils.cache import cache_stats
+
+        cache = cache_stats()
+        lines += [
+            '# HELP ecosense_cache_requests_total Lectures du cache des analyses.',
+            '# TYPE ecosense_cache_requests_total counter',
+            f'ecosense_cache_requests_total{{result="hit"}} {cache["hits"]}',
+            f'ecosense_cache_requests_total{{result="miss"}} {cache["misses"]}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+class RequestStats:
+    """Mesures de la requête en cours (dans g)"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.rows_start = rows_fetched()
+        self.status = 500  # remplacé par after_request si une réponse est produite
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.sql = []  # (durée, instruction), au plus MAX_STATEMENTS
+
+
+def _current():
+    if has_request_context():
+        return g.get('request_stats')
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current() is not None:
+        context.metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current()
+    start = getattr(context, 'metrics_start', None)
+    if stats is None or start is None:
+        return
+    elapsed = time.perf_counter() - start
+    stats.statements += 1
+    stats.db_seconds += elapsed
+    if len(stats.sql) < MAX_STATEMENTS:
+        stats.sql.append((elapsed, statement))
+
+
+def _start_request():
+    g.request_stats = RequestStats()
+
+
+def _set_status(response):
+    stats = g.get('request_stats')
+    if stats is not None:
+        stats.status = response.status_code
+    return response
+
+
+def _finish_request(exception=None):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return
+    seconds = time.perf_counter() - stats.start
+    endpoint = request.endpoint or 'inconnu'
+    rows = rows_fetched() - stats.rows_start
+    _metrics.record(endpoint, stats.status, seconds, stats.statements, stats.db_seconds, rows)
+
+    if seconds * 1000 >= config.SLOW_REQUEST_MS:
+        slowest = sorted(stats.sql, key=lambda item: item[0], reverse=True)[:SLOW_LOG_STATEMENTS]
+        details = ''.join(f'\n    {elapsed * 1000:.1f} ms : {" ".join(statement.split())[:500]}'
+                          for elapsed, statement in slowest)
+        current_app.logger.warning(
+            'Requête lente : %s %s (%s) %.0f ms, %d instructions SQL (%.0f ms en base), %d lignes lues%s',
+            request.method, request.path, endpoint, seconds * 1000, stats.statements,
+            stats.db_seconds * 1000, rows, details
+        )
+
+
+def init_app(app):
+    """Branche les mesures sur l'application et sur tous les moteurs SQLAlchemy"""
+    if not config.METRICS_ENABLED:
+        return
+    # Écoute sur la classe Engine : le moteur peut être recréé (dispose_engine)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_set_status)
+    app.teardown_request(_finish_request)
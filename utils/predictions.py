@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+from models.database import db_session
+from utils.cache import cached_analytics, get_data_version
+from utils.calculations import aggregations
+from utils.forecast import fit_trend, forecast, load_model, save_model
+
+# Chemin des prédictions : seul module d'analyse qui dépend de NumPy (via utils/forecast.py).
+# Les autres pages n'importent que utils/calculations.py.
+
+
+def _trend_parameters(db, user_id, today):
+    """(usage_count, slope, intercept, n_points) de la tendance des 30 derniers jours
+
+    Les paramètres sont relus depuis prediction_models tant que les données de l'utilisateur
+    et le jour n'ont pas changé ; sinon la tendance est réajustée puis enregistrée.
+    """
+    data_version = get_data_version(user_id)
+    model = load_model(db, user_id, data_version, today.date())
+    if model is not None:
+        return model.usage_count, model.slope, model.intercept, model.n_points
+
+    # Récupérer les 30 derniers jours
+    month_ago = today - timedelta(days=30)
+    _, usage_count = aggregations().total_and_count(db, user_id, start=month_ago)
+
+    slope = intercept = None
+    n_points = 0
+    if usage_count >= 7:
+        # Totaux par jour calculés en SQL
+        daily_data = aggregations().daily_totals(db, user_id, start=month_ago)
+        dates = sorted(daily_data.keys())
+        slope, intercept = fit_trend([daily_data[date] for date in dates])
+        n_points = len(dates)
+
+    save_model(user_id, data_version, today.date(), usage_count, slope, intercept, n_points)
+    return usage_count, slope, intercept, n_points
+
+
+@cached_analytics
+def predict_next_week(user_id):
+    """Prédiction pour la semaine prochaine avec régression linéaire"""
+    with db_session() as db:
+        today = datetime.now()
+        usage_count, slope, intercept, n_points = _trend_parameters(db, user_id, today)
+
+        if usage_count < 7:
+            return None  # Pas assez de données
+
+        # Prédire les 7 prochains jours
+        predictions = forecast(slope, intercept, n_points)
+
+        result = []
+        for i, pred in enumerate(predictions):
+            future_date = today + timedelta(days=i + 1)
+            result.append({
+                'date': future_date.strftime('%Y-%m-%d'),
+                'day_name': future_date.strftime('%a'),
+                'prediction': round(max(0, pred), 2)
+            })
+
+        return result
@@ -0,0 +1,134 @@
+import os
+import re
+import sqlite3
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import config
+
+# Profilage des instructions SQL lentes (activé par ECOSENSE_QUERY_PROFILER=1).
+# Toute instruction plus lente que config.SLOW_QUERY_MS est gardée dans un tampon
+# circulaire borné (config.SLOW_QUERY_BUFFER entrées) avec : le SQL normalisé, la forme
+# des paramètres, la route ou fonction d'analyse appelante et, sous SQLite, le plan
+# d'exécution (EXPLAIN QUERY PLAN). Les plans qui parcourent toute une table sont signalés.
+# Le tampon est affiché dans le panel d'administration.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Fichiers ignorés pour retrouver l'appelant : mesures et profilage eux-mêmes
+_SKIPPED_FILES = {os.path.join(ROOT, 'utils', name) for name in ('profiler.py', 'metrics.py')}
+# Appelant recherché : la route (app.py) ou la fonction d'analyse (utils/calculations.py),
+# plutôt que les modules d'accès aux données qu'elles utilisent
+_CALLER_FILES = {os.path.join(ROOT, 'app.py'), os.path.join(ROOT, 'utils', 'calculations.py')}
+_IN_LIST = re.compile(r'\((\s*\?\s*,)+\s*\?\s*\)')
+
+_entries = deque(maxlen=config.SLOW_QUERY_BUFFER)
+
+
+def normalize_sql(statement):
+    """SQL sur une ligne, listes IN (?, ?, ...) réduites à IN (...)"""
+    return _IN_LIST.sub('(...)', ' '.join(statement.split()))
+
+
+def parameters_shape(parameters, executemany):
+    """Types des paramètres, sans leurs valeurs (ex: '3 lignes x (int, str)')"""
+    if executemany:
+        rows = list(parameters)
+        shape = parameters_shape(rows[0], False) if rows else '()'
+        return f'{len(rows)} lignes x {shape}'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in parameters or ()) + ')'
+
+
+def call_site():
+    """Route ou fonction d'analyse à l'origine de l'instruction (fichier:ligne fonction)
+
+    En remontant la pile depuis l'instruction : premier appel situé dans app.py ou
+    utils/calculations.py ; à défaut (thread des alertes, scripts), premier appel situé
+    dans le code de l'application.
+    """
+    innermost = None
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if not filename.startswith(ROOT + os.sep) or filename in _SKIPPED_FILES:
+            continue
+        site = f'{os.path.relpath(filename, ROOT)}:{frame.lineno} {frame.name}'
+        if filename in _CALLER_FILES:
+            return site
+        innermost = innermost or site
+    return innermost
+
+
+def explain(dbapi_connection, statement, parameters):
+    """Lignes de EXPLAIN QUERY PLAN (SQLite, lectures seulement) ; None si non applicable"""
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    # Curseur dédié : ni compté dans les lignes lues, ni intercepté par les événements du moteur
+    cursor = sqlite3.Cursor(dbapi_connection)
+    try:
+        return [detail for _, _, _, detail in cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+    except sqlite3.Error:
+        return None
+    finally:
+        cursor.close()
+
+
+def is_full_scan(plan):
+    """Le plan parcourt-il une table entière (SCAN sans index) ?"""
+    return any(
+        detail.startswith('SCAN ') and 'USING' not in detail and 'CONSTANT ROW' not in detail
+        for detail in plan or ()
+    )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.profiler_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'profiler_start', None)
+    if start is None:
+        return
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if elapsed_ms < config.SLOW_QUERY_MS:
+        return
+
+    plan = None
+    if conn.dialect.name == 'sqlite' and not executemany:
+        plan = explain(cursor.connection, statement, parameters)
+    _entries.append({
+        'date': datetime.now(),
+        'duration_ms': round(elapsed_ms, 2),
+        'sql': normalize_sql(statement),
+        'parameters': parameters_shape(parameters, executemany),
+        'call_site': call_site(),
+        'endpoint': request.endpoint if has_request_context() else None,
+        'plan': plan,
+        'full_scan': is_full_scan(plan),
+    })
+
+
+def slow_queries():
+    """Entrées du tampon, de la plus récente à la plus ancienne"""
+    return list(reversed(_entries))
+
+
+def clear():
+    _entries.clear()
+
+
+def is_enabled():
+    return event.contains(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def install():
+    """Active le profilage sur tous les moteurs si config.QUERY_PROFILER"""
+    if not config.QUERY_PROFILER or is_enabled():
+        return
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
@@ -0,0 +1,230 @@
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from models.database import db_session, ArchivedMonth, DailyConsumption, DailyTotal, Usage
+
+# Maintenance des cumuls journaliers : daily_consumption (par utilisateur, équipement et jour)
+# et daily_totals (par utilisateur et jour, tous équipements confondus).
+# Les fonctions record_* doivent être appelées avant le commit de la modification
+# de Usage : les cumuls sont ainsi mis à jour dans la même transaction.
+#
+# Elles retournent les jours dont le total a changé, à transmettre à l'évaluation
+# des alertes (utils/alerts.py) après le commit.
+
+
+def _update_daily_total(db, user_id, day, kwh, count):
+    """Ajoute kwh au total du jour (une seule requête, UPSERT)"""
+    stmt = insert(DailyTotal).values(user_id=user_id, day=day, kwh=kwh, count=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'day'],
+        set_={
+            'kwh': DailyTotal.kwh + kwh,
+            'count': DailyTotal.count + count,
+        }
+    )
+    db.execute(stmt)
+
+
+def _delete_empty_totals(db, user_id):
+    db.query(DailyTotal).filter(
+        DailyTotal.user_id == user_id,
+        DailyTotal.count <= 0
+    ).delete(synchronize_session=False)
+
+
+def _apply(db, usage, sign):
+    """Ajoute (sign=1) ou retire (sign=-1) une utilisation des cumuls journaliers"""
+    day = usage.date.date()
+    kwh = sign * usage.consommation_kwh
+    hours = sign * usage.duree_heures
+
+    stmt = insert(DailyConsumption).values(
+        user_id=usage.user_id,
+        equipment_id=usage.equipment_id,
+        day=day,
+        kwh=kwh,
+        hours=hours,
+        count=sign
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'day', 'equipment_id'],
+        set_={
+            'kwh': DailyConsumption.kwh + kwh,
+            'hours': DailyConsumption.hours + hours,
+            'count': DailyConsumption.count + sign,
+        }
+    )
+    db.execute(stmt)
+    _update_daily_total(db, usage.user_id, day, kwh, sign)
+
+    if sign < 0:
+        # Plus aucune utilisation ce jour-là : on supprime la ligne
+        db.query(DailyConsumption).filter(
+            DailyConsumption.user_id == usage.user_id,
+            DailyConsumption.equipment_id == usage.equipment_id,
+            DailyConsumption.day == day,
+            DailyConsumption.count <= 0
+        ).delete(synchronize_session=False)
+        db.query(DailyTotal).filter(
+            DailyTotal.user_id == usage.user_id,
+            DailyTotal.day == day,
+            DailyTotal.count <= 0
+        ).delete(synchronize_session=False)
+
+    return [day]
+
+
+def record_usage_added(db, usage):
+    """À appeler après db.add(usage)"""
+    return _apply(db, usage, 1)
+
+
+def record_usage_removed(db, usage):
+    """À appeler avant db.delete(usage), ou avant de modifier une utilisation"""
+    return _apply(db, usage, -1)
+
+
+def record_usages_added(db, usages):
+    """Version groupée de record_usage_added pour des dictionnaires (import en masse)
+
+    Les utilisations sont d'abord regroupées par (équipement, jour) : une seule mise à jour
+    du cumul par groupe, envoyée en un seul executemany.
+    """
+    deltas = {}
+    for usage in usages:
+        key = (usage['user_id'], usage['equipment_id'], usage['date'].date())
+        kwh, hours, count = deltas.get(key, (0.0, 0.0, 0))
+        deltas[key] = (kwh + usage['consommation_kwh'], hours + usage['duree_heures'], count + 1)
+    if not deltas:
+        return []
+
+    stmt = insert(DailyConsumption)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'day', 'equipment_id'],
+        set_={
+            'kwh': DailyConsumption.kwh + stmt.excluded.kwh,
+            'hours': DailyConsumption.hours + stmt.excluded.hours,
+            'count': DailyConsumption.count + stmt.excluded.count,
+        }
+    )
+    db.execute(stmt, [
+        {'user_id': user_id, 'equipment_id': equipment_id, 'day': day, 'kwh': kwh, 'hours': hours, 'count': count}
+        for (user_id, equipment_id, day), (kwh, hours, count) in deltas.items()
+    ])
+
+    day_deltas = {}
+    for (user_id, _, day), (kwh, _, count) in deltas.items():
+        total_kwh, total_count = day_deltas.get((user_id, day), (0.0, 0))
+        day_deltas[(user_id, day)] = (total_kwh + kwh, total_count + count)
+    return _update_daily_totals(db, day_deltas)
+
+
+def _update_daily_totals(db, day_deltas):
+    """Applique {(user_id, jour): (kWh, nombre)} à daily_totals (un seul executemany)"""
+    stmt = insert(DailyTotal)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'day'],
+        set_={
+            'kwh': DailyTotal.kwh + stmt.excluded.kwh,
+            'count': DailyTotal.count + stmt.excluded.count,
+        }
+    )
+    db.execute(stmt, [
+        {'user_id': user_id, 'day': day, 'kwh': kwh, 'count': count}
+        for (user_id, day), (kwh, count) in day_deltas.items()
+    ])
+
+    for user_id in {user_id for user_id, _ in day_deltas}:
+        _delete_empty_totals(db, user_id)
+    return sorted({day for _, day in day_deltas})
+
+
+def record_equipment_removed(db, equipment_id):
+    """Retire des cumuls un équipement (ses utilisations sont supprimées avec lui)"""
+    rows = db.query(
+        DailyConsumption.user_id, DailyConsumption.day, DailyConsumption.kwh, DailyConsumption.count
+    ).filter(DailyConsumption.equipment_id == equipment_id).all()
+
+    db.query(DailyConsumption).filter(
+        DailyConsumption.equipment_id == equipment_id
+    ).delete(synchronize_session=False)
+
+    if not rows:
+        return []
+    return _update_daily_totals(db, {
+        (user_id, day): (-kwh, -count) for user_id, day, kwh, count in rows
+    })
+
+
+def _add_archived(db, user_id=None):
+    """Ajoute aux cumuls les utilisations archivées (utils/archive.py), s'il y en a"""
+    archives = db.query(ArchivedMonth.id)
+    if user_id is not None:
+        archives = archives.filter(ArchivedMonth.user_id == user_id)
+    if archives.first() is None:
+        return
+
+    from utils.archive import archived_daily
+
+    stmt = insert(DailyConsumption)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'day', 'equipment_id'],
+        set_={
+            'kwh': DailyConsumption.kwh + stmt.excluded.kwh,
+            'hours': DailyConsumption.hours + stmt.excluded.hours,
+            'count': DailyConsumption.count + stmt.excluded.count,
+        }
+    )
+    rows = archived_daily(db, user_id)
+    if rows:
+        db.execute(stmt, [
+            {'user_id': row_user_id, 'equipment_id': equipment_id, 'day': day,
+             'kwh': kwh, 'hours': hours, 'count': count}
+            for row_user_id, equipment_id, day, kwh, hours, count in rows
+        ])
+
+
+def rebuild_rollup(db, user_id=None):
+    """Recalcule daily_consumption et daily_totals à partir des utilisations, archives comprises
+
+    Tous les utilisateurs par défaut.
+    """
+    delete_query = db.query(DailyConsumption)
+    delete_totals = db.query(DailyTotal)
+    source = db.query(
+        Usage.user_id,
+        Usage.equipment_id,
+        func.date(Usage.date),
+        func.sum(Usage.consommation_kwh),
+        func.sum(Usage.duree_heures),
+        func.count(Usage.id)
+    )
+    totals_source = db.query(
+        DailyConsumption.user_id,
+        DailyConsumption.day,
+        func.sum(DailyConsumption.kwh),
+        func.sum(DailyConsumption.count)
+    )
+    if user_id is not None:
+        delete_query = delete_query.filter(DailyConsumption.user_id == user_id)
+        delete_totals = delete_totals.filter(DailyTotal.user_id == user_id)
+        source = source.filter(Usage.user_id == user_id)
+        totals_source = totals_source.filter(DailyConsumption.user_id == user_id)
+    source = source.group_by(Usage.user_id, Usage.equipment_id, func.date(Usage.date))
+    totals_source = totals_source.group_by(DailyConsumption.user_id, DailyConsumption.day)
+
+    delete_query.delete(synchronize_session=False)
+    delete_totals.delete(synchronize_session=False)
+    db.execute(insert(DailyConsumption).from_select(
+        ['user_id', 'equipment_id', 'day', 'kwh', 'hours', 'count'],
+        source
+    ))
+    _add_archived(db, user_id)
+    db.execute(insert(DailyTotal).from_select(['user_id', 'day', 'kwh', 'count'], totals_source))
+    db.commit()
+    return db.query(func.count(DailyConsumption.id)).scalar()
+
+
+if __name__ == '__main__':
+    with db_session() as db:
+        rows = rebuild_rollup(db)
+    print(f"Cumuls journaliers reconstruits : {rows} lignes.")
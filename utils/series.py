@@ -0,0 +1,303 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from models.database import DailyConsumption, Equipment
+from utils.cache import get_data_version
+import utils.aggregations as sql_aggregations
+import config
+
+# Séries journalières en mémoire (config.ANALYTICS_BACKEND = 'series').
+# Pour chaque utilisateur : une matrice NumPy équipements × jours des kWh et du nombre
+# d'utilisations, indexée par l'écart en jours depuis le plus ancien jour connu.
+# Chargée au premier accès (une requête sur daily_consumption), corrigée sur place après
+# les modifications d'utilisations (patch_series), rechargée si users.data_version a changé
+# ailleurs (autre processus, import, équipement modifié). Les utilisateurs les moins
+# récemment lus sont évincés au-delà de config.SERIES_MAX_MB.
+#
+# La matrice s'arrête à aujourd'hui + HORIZON_DAYS (comme la fenêtre de utils/batch_forecast.py) :
+# une utilisation datée loin dans le futur (ex: 9999-12-31) ne l'étend pas. Une série qui dépasserait
+# à elle seule config.SERIES_MAX_MB n'est pas gardée. Dans ces deux cas, les lectures concernées
+# (période ouverte au-delà de la matrice, ou série absente) sont faites en SQL.
+#
+# Les fonctions de lecture ont la même interface que celles de utils/aggregations.py
+# (mêmes résultats, bornes à la journée : start inclus, end exclu).
+
+HORIZON_DAYS = 7
+
+
+def _as_day(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+class UserSeries:
+    """Consommation journalière d'un utilisateur, par équipement, depuis origin"""
+
+    def __init__(self, version, origin, limit, beyond, equipment_ids, names, kwh, counts):
+        self.version = version
+        self.origin = origin
+        self.limit = limit      # dernier jour que la matrice peut couvrir
+        self.beyond = beyond    # des utilisations existent après limit (hors matrice)
+        self.equipment_ids = equipment_ids
+        self.names = names
+        self.rows = {equipment_id: i for i, equipment_id in enumerate(equipment_ids)}
+        self.kwh = kwh          # float64, équipements × jours
+        self.counts = counts    # int64, équipements × jours
+
+    @staticmethod
+    def nbytes_for(equipments, days):
+        return equipments * days * (np.dtype(np.float64).itemsize + np.dtype(np.int64).itemsize)
+
+    @classmethod
+    def load(cls, db, user_id, version, max_bytes):
+        """Série de l'utilisateur, ou None si elle dépasserait max_bytes"""
+        rows = db.query(
+            DailyConsumption.equipment_id, Equipment.name, DailyConsumption.day,
+            DailyConsumption.kwh, DailyConsumption.count
+        ).outerjoin(
+            Equipment, Equipment.id == DailyConsumption.equipment_id
+        ).filter(DailyConsumption.user_id == user_id).all()
+
+        today = datetime.now().date()
+        limit = today + timedelta(days=HORIZON_DAYS)
+        beyond = any(day > limit for _, _, day, _, _ in rows)
+        rows = [row for row in rows if row[2] <= limit]
+        origin = min((day for _, _, day, _, _ in rows), default=today)
+        last = max((day for _, _, day, _, _ in rows), default=today)
+        names = {equipment_id: name for equipment_id, name, _, _, _ in rows}
+        equipment_ids = sorted(names)
+        shape = (len(equipment_ids), (max(last, today) - origin).days + 1)
+        if cls.nbytes_for(*shape) > max_bytes:
+            return None
+        series = cls(version, origin, limit, beyond, equipment_ids, [names[i] for i in equipment_ids],
+                     np.zeros(shape), np.zeros(shape, dtype=np.int64))
+        if rows:
+            index = (np.array([series.rows[equipment_id] for equipment_id, _, _, _, _ in rows]),
+                     np.array([(day - origin).days for _, _, day, _, _ in rows]))
+            np.add.at(series.kwh, index, [kwh for _, _, _, kwh, _ in rows])
+            np.add.at(series.counts, index, [count for _, _, _, _, count in rows])
+        return series
+
+    @property
+    def days(self):
+        return self.kwh.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.kwh.nbytes + self.counts.nbytes
+
+    def covers(self, end):
+        """La matrice contient-elle toutes les utilisations avant end (None : sans borne) ?"""
+        return not self.beyond or (end is not None and _as_day(end) <= self.limit)
+
+    def patched(self, version, deltas, max_bytes):
+        """Copie à la version `version` avec les deltas [(equipment_id, jour, kWh, nombre)] appliqués,
+        ou None si un équipement est inconnu ou si la copie dépasserait max_bytes"""
+        if any(equipment_id not in self.rows for equipment_id, _, _, _ in deltas):
+            return None
+        # Jours au-delà de limit : hors matrice, lus en SQL
+        beyond = self.beyond or any(day > self.limit for _, day, _, _ in deltas)
+        deltas = [delta for delta in deltas if delta[1] <= self.limit]
+        first = min([self.origin] + [day for _, day, _, _ in deltas])
+        last = max([self.origin + timedelta(days=self.days - 1)] + [day for _, day, _, _ in deltas])
+        before, after = (self.origin - first).days, (last - self.origin).days + 1 - self.days
+        if self.nbytes_for(len(self.equipment_ids), self.days + before + after) > max_bytes:
+            return None
+        kwh = np.pad(self.kwh, ((0, 0), (before, after)))
+        counts = np.pad(self.counts, ((0, 0), (before, after)))
+        for equipment_id, day, delta_kwh, delta_count in deltas:
+            kwh[self.rows[equipment_id], (day - first).days] += delta_kwh
+            counts[self.rows[equipment_id], (day - first).days] += delta_count
+        return UserSeries(version, first, self.limit, beyond, self.equipment_ids, self.names, kwh, counts)
+
+    def window(self, start=None, end=None):
+        """(premier jour, kWh, nombres) par équipement sur [start, end[ ramené à la matrice,
+        complétés par des zéros (les jours hors matrice n'ont aucune utilisation)"""
+        # Bornes ramenées à [origin, fin de la matrice] : pas de tableau ni de calcul de date
+        # sur une période arbitraire (la fin de la matrice est au plus limit + 1 jour, loin de date.max)
+        matrix_end = self.origin + timedelta(days=self.days)
+        start = self.origin if start is None else min(max(_as_day(start), self.origin), matrix_end)
+        end = matrix_end if end is None else min(max(_as_day(end), start), matrix_end)
+        offset = (start - self.origin).days
+        lo, hi = max(offset, 0), min(offset + (end - start).days, self.days)
+
+        kwh = np.zeros((len(self.equipment_ids), (end - start).days))
+        counts = np.zeros(kwh.shape, dtype=np.int64)
+        if lo < hi:
+            kwh[:, lo - offset:hi - offset] = self.kwh[:, lo:hi]
+            counts[:, lo - offset:hi - offset] = self.counts[:, lo:hi]
+        return start, kwh, counts
+
+    def sums(self, start=None, end=None):
+        """(kWh, nombres) totaux par équipement sur [start, end[, sans copie de la période"""
+        lo = 0 if start is None else max((_as_day(start) - self.origin).days, 0)
+        hi = self.days if end is None else min((_as_day(end) - self.origin).days, self.days)
+        hi = max(lo, hi)
+        return self.kwh[:, lo:hi].sum(axis=1), self.counts[:, lo:hi].sum(axis=1)
+
+
+class SeriesStore:
+    """Séries des utilisateurs du processus, LRU bornée en mémoire"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refused = 0  # séries plus grandes que max_bytes, lues en SQL
+        self._entries = OrderedDict()  # user_id -> UserSeries
+        self._lock = threading.Lock()
+
+    def get(self, db, user_id):
+        """Série à jour de l'utilisateur, ou None si elle dépasse la mémoire allouée"""
+        version = get_data_version(user_id)
+        with self._lock:
+            series = self._entries.get(user_id)
+            if series is not None and series.version == version:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return series
+            self.misses += 1
+
+        series = UserSeries.load(db, user_id, version, self.max_bytes)
+        with self._lock:
+            if series is None:
+                self.refused += 1
+                self._discard(user_id)
+            else:
+                self._put(user_id, series)
+        return series
+
+    def patch(self, user_id, version, deltas):
+        """Applique les deltas de la modification validée qui a publié la version `version`
+
+        Seule une série à la version précédente peut être corrigée : une série rechargée
+        entre le commit et cet appel contient déjà la modification, une série plus ancienne
+        en manque d'autres. Dans ces deux cas elle est évincée (rechargée à la lecture suivante).
+        """
+        with self._lock:
+            series = self._entries.get(user_id)
+            if series is None:
+                return
+            patched = series.patched(version, deltas, self.max_bytes) if series.version == version - 1 else None
+            if patched is None:
+                self._discard(user_id)
+            else:
+                self._put(user_id, patched)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._discard(user_id)
+
+    def _discard(self, user_id):
+        series = self._entries.pop(user_id, None)
+        if series is not None:
+            self.bytes -= series.nbytes
+
+    def _put(self, user_id, series):
+        # Remplacement d'objet entier : les lectures en cours gardent l'ancienne série
+        self._discard(user_id)
+        self._entries[user_id] = series
+        self.bytes += series.nbytes
+        while self.bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def stats(self):
+        return {'users': len(self._entries), 'bytes': self.bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'refused': self.refused}
+
+
+_store = SeriesStore(config.SERIES_MAX_MB * 1024 * 1024)
+
+
+def get_store():
+    return _store
+
+
+def patch_series(user_id, version, deltas):
+    """À appeler après le commit : version retournée par bump_data_version, deltas [(equipment_id, jour, kWh, nombre)]"""
+    _store.patch(user_id, version, deltas)
+
+
+def _series(db, user_id, end):
+    """Série couvrant toutes les utilisations avant end, ou None : lecture en SQL"""
+    series = _store.get(db, user_id)
+    if series is None or not series.covers(end):
+        return None
+    return series
+
+
+def total_consumption(db, user_id, start=None, end=None):
+    """Consommation totale (kWh) sur [start, end[ (bornes optionnelles)"""
+    return total_and_count(db, user_id, start, end)[0]
+
+
+def total_and_count(db, user_id, start=None, end=None):
+    """Consommation totale (kWh) et nombre d'utilisations sur [start, end["""
+    series = _series(db, user_id, end)
+    if series is None:
+        return sql_aggregations.total_and_count(db, user_id, start, end)
+    kwh, counts = series.sums(start, end)
+    return float(kwh.sum()), int(counts.sum())
+
+
+def daily_totals(db, user_id, start=None, end=None):
+    """Totaux par jour : {'YYYY-MM-DD': kWh}"""
+    series = _series(db, user_id, end)
+    if series is None:
+        return sql_aggregations.daily_totals(db, user_id, start, end)
+    first, kwh, counts = series.window(start, end)
+    kwh, counts = kwh.sum(axis=0), counts.sum(axis=0)
+    return {
+        (first + timedelta(days=int(i))).strftime('%Y-%m-%d'): float(kwh[i])
+        for i in np.flatnonzero(counts > 0)
+    }
+
+
+def monthly_totals(db, user_id, start=None, end=None):
+    """Totaux par mois calendaire : {'YYYY-MM': kWh}"""
+    series = _series(db, user_id, end)
+    if series is None:
+        return sql_aggregations.monthly_totals(db, user_id, start, end)
+    first, kwh, counts = series.window(start, end)
+    kwh, counts = kwh.sum(axis=0), counts.sum(axis=0)
+    present = counts > 0
+    days = np.datetime64(first, 'D') + np.flatnonzero(present)
+    months, month_index = np.unique(days.astype('datetime64[M]'), return_inverse=True)
+    totals = np.bincount(month_index, weights=kwh[present], minlength=len(months))
+    return {str(month): float(total) for month, total in zip(months, totals)}
+
+
+def equipment_totals(db, user_id, start=None, end=None, limit=None):
+    """Totaux par équipement, du plus consommateur au moins consommateur : [(nom, kWh)]"""
+    series = _series(db, user_id, end)
+    if series is None:
+        return sql_aggregations.equipment_totals(db, user_id, start, end, limit)
+    kwh, counts = series.sums(start, end)
+    totals = {}
+    for i in np.flatnonzero(counts > 0):
+        name = series.names[i]
+        if name is not None:
+            totals[name] = totals.get(name, 0.0) + float(kwh[i])
+    result = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+    return result[:limit] if limit is not None else result
+
+
+def dashboard_rows(db, user_id, recent_start):
+    """Même résultat que utils.aggregations.dashboard_rows : [(nom, 'YYYY-MM-DD' ou None, kWh, nombre)]"""
+    series = _series(db, user_id, None)
+    if series is None:
+        return sql_aggregations.dashboard_rows(db, user_id, recent_start)
+    old_kwh, old_counts = series.sums(None, recent_start)
+    first, kwh, counts = series.window(recent_start, None)
+
+    rows = []
+    for i in np.flatnonzero(old_counts > 0):
+        rows.append((series.names[i], None, float(old_kwh[i]), int(old_counts[i])))
+    for i, day in zip(*np.nonzero(counts > 0)):
+        rows.append((series.names[i], (first + timedelta(days=int(day))).isoformat(),
+                     float(kwh[i, day]), int(counts[i, day])))
+    return rows